@@ -12,6 +12,12 @@ import warnings
 import requests
 from requests import Response
 
+# orjson parses Apollo's large responses several times faster, but isn't required
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
 
 @dataclass
 class RequestRemaining:
@@ -37,6 +43,53 @@ class RequestRemaining:
         return 0
 
 
+@dataclass(slots=True)
+class Person:
+    """A person returned by Apollo, holding only the fields we store"""
+
+    id: str
+    first_name: str
+    last_name: str
+    title: str
+    email: str
+    phone: str
+    organization_id: str
+
+    @classmethod
+    def from_json(cls, person: dict):
+        """
+        Projects one of Apollo's person dicts into a Person
+
+        Example::
+
+            >>> Person.from_json({'id': '1', 'first_name': 'Bob', 'last_name': 'Smith',
+            ...                   'title': 'CTO', 'email': None, 'organization_id': 'asd',
+            ...                   'phone_numbers': [{'sanitized_number': '+12024561111'}],
+            ...                   'employment_history': []})
+            Person(id='1', first_name='Bob', last_name='Smith', title='CTO', email=None, \
+phone='+12024561111', organization_id='asd')
+        """
+        phone_numbers = person.get('phone_numbers')
+        return cls(
+            person.get('id'), person.get('first_name'), person.get('last_name'),
+            person.get('title'), person.get('email'),
+            phone_numbers[0].get('sanitized_number') if phone_numbers else None,
+            person.get('organization_id'))
+
+
+@dataclass(slots=True)
+class Organization:
+    """An organization returned by Apollo, holding only the fields we store"""
+
+    id: str
+    primary_domain: str
+
+    @classmethod
+    def from_json(cls, organization: dict):
+        """Projects one of Apollo's organization dicts into an Organization"""
+        return cls(organization.get('id'), organization.get('primary_domain'))
+
+
 class ApolloAPI:
     """
     Provides controlled access to Apollo's api.
@@ -86,28 +139,25 @@ class ApolloAPI:
         :param people:
         :type people: list
         :param org_ids:
-        :type org_ids: list
+        :type org_ids: iterable
         :return: list of people
         :rtype: list
 
         Example::
 
-            >>> ApolloAPI.filter_by_org_ids([
-            ...     {'name':'bob', 'organization_id': 'asd'},
-            ...     {'name':'john', 'organization_id': 'qwe'}, ]
-            ... , ['asd','asdf']) == [{'name': 'bob', 'organization_id': 'asd'}]
+            >>> bob = Person('1', 'bob', None, None, None, None, 'asd')
+            >>> john = Person('2', 'john', None, None, None, None, 'qwe')
+            >>> ApolloAPI.filter_by_org_ids([bob, john], ['asd','asdf']) == [bob]
             True
-            >>> ApolloAPI.filter_by_org_ids([
-            ...     {'name':'bob', 'organization_id': 'asd'},
-            ...     {'name':'john', 'organization_id': 'qwe'}, ]
-            ... , [])
+            >>> ApolloAPI.filter_by_org_ids([bob, john], [])
             []
             >>> ApolloAPI.filter_by_org_ids([],['asd','asdf'])
             []
 
 
         """
-        return [person for person in people if person['organization_id'] in org_ids]
+        org_ids = set(org_ids)
+        return [person for person in people if person.organization_id in org_ids]
 
     def get_people(self, domains: [str], titles: [str] = None):
         """
@@ -120,7 +170,7 @@ class ApolloAPI:
         :param titles: titles to search for such as 'CEO' or 'COO'
         :type titles: list
         :return: list of people
-        :rtype: list
+        :rtype: list[Person]
         """
 
         if titles is None:
@@ -139,7 +189,7 @@ class ApolloAPI:
 
         resp = self.__api_post_call(data, 'mixed_people/search')
 
-        return resp.json()['people']
+        return [Person.from_json(person) for person in loads(resp.content)['people']]
 
     def get_people_filtered(self, domains: [str], titles: [str] = None):
         """
@@ -152,7 +202,7 @@ class ApolloAPI:
         :param titles: titles to search for such as 'CEO' or 'COO'
         :type titles: list
         :return: list of people
-        :rtype: list
+        :rtype: list[Person]
 
         Example::
 
@@ -160,10 +210,10 @@ class ApolloAPI:
             True
             >>> api = ApolloAPI(os.getenv('APOLLO_API_KEY'))
             >>> api.get_people_filtered('seclytics.com','CEO') # doctest: +ELLIPSIS
-            [{'id': '61151850418eb80001ce98ce'...
+            [Person(id='61151850418eb80001ce98ce'...
             >>> results = api.get_people_filtered(['seclytics.com'], ['CEO', 'Head of Engineering'])
-            >>> isinstance(results, list) and len(results) == 2 and all(isinstance(item, dict) for
-            ... item in results)  # check is in form [{...},{...}]
+            >>> isinstance(results, list) and len(results) == 2 and all(isinstance(item, Person) for
+            ... item in results)  # check is in form [Person(...),Person(...)]
             True
             >>> api.get_people_filtered('websitethatdoesnotexistasdf','CEO')
             []
@@ -172,7 +222,7 @@ class ApolloAPI:
         """
 
         # get all org_ids associated with organization
-        org_id = [org_id for domain, org_id in self.get_org_ids(domains).items()]
+        org_id = set(self.get_org_ids(domains).values())
 
         # get all people related to titles and organization
         ppl = self.get_people(domains, titles)
@@ -220,15 +270,14 @@ class ApolloAPI:
         resp = self.__api_post_call(data, 'organizations/' + endpoint)
 
         # Handle cases of none, one, or multiple organizations being returned
-        if resp.json() == {}:
-            return {}
-        if 'organization' in resp.json():
-            return {
-                resp.json()['organization']['primary_domain']: resp.json()['organization']['id'],
-            }
+        body = loads(resp.content)
+        if 'organization' in body:
+            organizations = [body['organization']]
+        else:
+            organizations = body.get('organizations') or []
         return {
-            org['primary_domain']: org['id'] for org in resp.json()['organizations']
-            if org is not None
+            org.primary_domain: org.id for org in
+            (Organization.from_json(org) for org in organizations if org is not None)
         }
 
     def __api_post_call(self, payload, endpoint: str) -> Response:
@@ -0,0 +1,189 @@
+"""
+Benchmarks
+===========
+
+Micro-benchmarks for the hot paths, run with `python benchmarks.py`.
+"""
+from contextlib import closing
+import json
+import os
+import random
+import sqlite3
+import timeit
+import tracemalloc
+
+
+def apollo_people_response(count: int = 1000) -> bytes:
+    """
+    Builds a mixed_people/search response body shaped like Apollo's, with count people
+
+    :param count: number of people in the response
+    :type count: int
+    :rtype: bytes
+    """
+    rng = random.Random(0)
+
+    def organization(index):
+        return {
+            'id': f'{index:024x}', 'name': f'Org {index}', 'website_url': f'http://org{index}.com',
+            'primary_domain': f'org{index}.com', 'linkedin_url': f'http://linkedin.com/c/{index}',
+            'founded_year': 1990 + index % 30, 'estimated_num_employees': rng.randint(5, 5000),
+            'keywords': [f'keyword {k}' for k in range(20)], 'phone': '+1 202-456-1111',
+            'industry': 'information technology & services', 'raw_address': '1 Main St',
+        }
+
+    people = []
+    for index in range(count):
+        org = organization(index % 50)
+        people.append({
+            'id': f'{index:024x}', 'first_name': f'First{index}', 'last_name': f'Last{index}',
+            'name': f'First{index} Last{index}', 'title': 'Chief Technology Officer',
+            'email': f'first{index}@{org["primary_domain"]}', 'email_status': 'verified',
+            'linkedin_url': f'http://linkedin.com/in/{index}', 'photo_url': 'https://x.com/a.jpg',
+            'headline': 'CTO at Org', 'city': 'Austin', 'state': 'Texas', 'country': 'US',
+            'organization_id': org['id'], 'organization': org,
+            'phone_numbers': [{'raw_number': '(202) 456-1111', 'sanitized_number': '+12024561111',
+                               'type': 'work_hq', 'position': 0}],
+            'employment_history': [
+                {'organization_name': f'Org {job}', 'title': 'Engineer', 'current': job == 0,
+                 'start_date': '2010-01-01', 'end_date': None, 'organization_id': f'{job:024x}',
+                 'description': 'x' * 200} for job in range(5)],
+            'departments': ['c_suite', 'engineering'], 'seniority': 'c_suite',
+        })
+    return json.dumps({'people': people, 'pagination': {'page': 1}}).encode()
+
+
+def bench_apollo_people(count: int = 1000, repeat: int = 20):
+    """
+    Compares parse time and retained memory per `count` people between the old dict-based
+    path and Person records
+
+    :param count: number of people per response
+    :type count: int
+    :param repeat: number of times each path is timed
+    :type repeat: int
+    """
+    from apollo import Person, loads
+
+    body = apollo_people_response(count)
+    org_ids = [f'{index:024x}' for index in range(0, 50, 2)]
+
+    def dict_path():
+        people = json.loads(body)['people']
+        return [person for person in people if person['organization_id'] in org_ids]
+
+    def record_path():
+        people = [Person.from_json(person) for person in loads(body)['people']]
+        ids = set(org_ids)
+        return [person for person in people if person.organization_id in ids]
+
+    print(f'Apollo people, per {count} people ({len(body) / 1024:.0f} KiB response)')
+    for name, path in (('dicts', dict_path), ('records', record_path)):
+        seconds = min(timeit.repeat(path, number=1, repeat=repeat))
+        tracemalloc.start()
+        kept = path()
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        print(f'\t{name:<8} {seconds * 1000:8.2f} ms {retained / 1024:10.0f} KiB retained')
+
+
+# Schema of MSP.db before migrations, as up.sql first shipped it
+_baseline_schema = '''
+CREATE TABLE MSPs
+(
+    ID   INTEGER primary key AUTOINCREMENT,
+    Name TEXT,
+    URL  TEXT,
+    CompanyNumber TEXT
+);
+
+CREATE TABLE VIPs
+(
+    ID   INTEGER primary key AUTOINCREMENT,
+    MSPID INTEGER,
+    FirstName TEXT,
+    LastName TEXT,
+    Title TEXT,
+    Email TEXT,
+    Phone TEXT,
+    FOREIGN KEY (MSPID) REFERENCES MSPs(ID)
+);
+'''
+
+
+def bench_queries(msps: int = 500, vips: int = 200000, repeat: int = 5):
+    """
+    Times the hot queries as they ran against the baseline schema, then as they run now against
+    the fully migrated schema
+
+    :param msps: number of MSPs in the db
+    :type msps: int
+    :param vips: number of VIPs in the db
+    :type vips: int
+    :param repeat: number of times each query is timed
+    :type repeat: int
+    """
+    import main
+    from contacts import update_by_name
+    from migrations import migrate
+
+    rng = random.Random(0)
+    with closing(sqlite3.connect(':memory:')) as connection:
+        connection.executescript(_baseline_schema)
+        connection.executemany('''INSERT INTO MSPs (Name, URL) VALUES (?, ?)''',
+                               [(f'MSP {i}', f'msp{i}.com') for i in range(msps)])
+        connection.executemany(
+            '''INSERT INTO VIPs (MSPID, FirstName, LastName, Title, Email) '''
+            '''VALUES (?, ?, ?, ?, ?)''',
+            [(rng.randint(1, msps - 50), f'First{i}', f'Last{i}', 'CTO', f'f{i}@x.com')
+             for i in range(vips)])
+        connection.commit()
+        names = [(f'First{i}', f'Last{i}') for i in rng.sample(range(vips), 1000)]
+
+        def baseline_missed_msps():
+            keys = [key for (key,) in connection.execute(
+                '''WITH Numbers AS (SELECT 1 AS num UNION ALL SELECT num + 1 FROM Numbers '''
+                '''WHERE num < 500) SELECT num FROM Numbers '''
+                '''LEFT JOIN VIPs ON Numbers.num = VIPs.MSPID WHERE VIPs.MSPID IS NULL''')]
+            return connection.execute(
+                f'''SELECT * FROM MSPs WHERE ID IN ({','.join(map(str, keys))})''').fetchall()
+
+        def baseline_cleanse():
+            connection.executemany(
+                '''UPDATE VIPs SET Phone = '+12024561111' WHERE FirstName = ? AND LastName = ?''',
+                names)
+            connection.rollback()
+
+        def cleanse():
+            with closing(connection.cursor()) as cursor:
+                for first_name, last_name in names:
+                    update_by_name(cursor, first_name, last_name, phone='+12024561111')
+            connection.rollback()
+
+        # (baseline, current) version of each query
+        queries = {
+            'vips resume': (
+                lambda: connection.execute('''SELECT MAX(MSPID) FROM VIPs''').fetchone(),
+                lambda: connection.execute(
+                    '''SELECT ID, URL FROM MSPs '''
+                    '''WHERE NOT EXISTS (SELECT 1 FROM VIPs WHERE VIPs.MSPID = MSPs.ID)'''
+                ).fetchall()),
+            'missing MSPs': (baseline_missed_msps,
+                             lambda: main.get_missed_msps(connection.cursor())),
+            'cleanse, 1000 names': (baseline_cleanse, cleanse),
+            'export join': (lambda: main.export_csv(connection, os.devnull),) * 2,
+        }
+
+        print(f'Queries over {msps} MSPs and {vips} VIPs, best of {repeat}')
+        before = {name: min(timeit.repeat(baseline, number=1, repeat=repeat))
+                  for name, (baseline, _) in queries.items()}
+        migrate(connection)
+        for name, (_, current) in queries.items():
+            after = min(timeit.repeat(current, number=1, repeat=repeat))
+            print(f'\t{name:<20} {before[name] * 1000:10.2f} ms -> {after * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    bench_apollo_people()
+    bench_queries()
@@ -0,0 +1,104 @@
+"""
+Seamless Cleanse
+===========
+
+Reads the csvs exported by https://login.seamless.ai/enrich. Kept apart from the scraper, so
+loading a cleanse never needs selenium or a browser.
+"""
+from contextlib import nullcontext
+import pandas
+from normalize import Normalizer
+
+
+def extract_cleaned(csv_path: str, required_conf: int, normalizer: Normalizer = None) -> dict:
+    """
+    Get a parsed dictionary of cleaned data given a csv from https://login.seamless.ai/enrich
+
+    :param csv_path: full path, including file, of csv to extract from
+    :type csv_path: str
+    :param required_conf: % chance reqired to treat data as true (required_conf/100)
+    :type required_conf: int
+    :param normalizer: normalizer to share memoized results with, one is made if not given
+    :type normalizer: Normalizer
+    :return: dictionary of emails and phone numbers keyed by tuple (first, last) name
+    :rtype: dict
+
+    Example::
+
+        >>> import csv, os, tempfile
+        >>> csv_path = os.path.join(tempfile.mkdtemp(), 'cleaned.csv')
+        >>> with open(csv_path, 'w', newline='') as csv_file:
+        ...     writer = csv.DictWriter(csv_file, ['First Name', 'Last Name'] + [
+        ...         f'{kind} {i}{suffix}' for kind in ('Email', 'Contact Phone')
+        ...         for suffix in ('', ' Total AI') for i in range(1, 11)])
+        ...     _ = writer.writeheader()
+        ...     _ = writer.writerow({'First Name': 'Chuck', 'Last Name': 'Bloodworth',
+        ...                          'Email 1': 'cbloodworth@1path.com', 'Email 1 Total AI': '80%',
+        ...                          'Contact Phone 1': '(202) 456-1111',
+        ...                          'Contact Phone 1 Total AI': '95%'})
+        >>> extract_cleaned(csv_path, 70)
+        {('Chuck', 'Bloodworth'): {'email': 'cbloodworth@1path.com', 'phone': '+12024561111'}}
+    """
+
+    # load file and extracted needed columns
+    first_ten = pandas.read_csv(csv_path)[
+        ['First Name', 'Last Name'] +
+        [f'Email {i} Total AI' for i in range(1, 11)] +
+        [f'Email {i}' for i in range(1, 11)] +
+        [f'Contact Phone {i} Total AI' for i in range(1, 11)] +
+        [f'Contact Phone {i}' for i in range(1, 11)]
+        ]
+
+    # start results dictionary, and the emails and phones passing required_conf per name
+    result_list = {}
+    candidates = {}
+
+    # iterate through the 10 columns each of phone and email
+    for index in range(1, 11):
+
+        # 'total ai format' is ##%, change to integer to preform '>' operation against required_conf
+        temp_row = first_ten[first_ten[f'Email {index}'].notna()]
+        if not temp_row.empty:
+            first_ten[f'Email {index} Total AI'] = temp_row[
+                f'Email {index} Total AI'].str.replace('%', '').astype(int)
+
+        temp_row = first_ten[first_ten[f'Contact Phone {index}'].notna()]
+        if not temp_row.empty:
+            first_ten[f'Contact Phone {index} Total AI'] = temp_row[
+                f'Contact Phone {index} Total AI'].str.replace('%', '').astype(int)
+
+        # check if email and number meet criteria, and add them to our results
+        emails = first_ten[first_ten[f'Email {index} Total AI'] > required_conf].apply(
+            lambda row, idx:
+            {(row['First Name'], row['Last Name']): (row[f'Email {idx}'])},
+            args=(index,),
+            axis=1).tolist()
+        phones = first_ten[first_ten[f'Contact Phone {index} Total AI'] > required_conf].apply(
+            lambda row, idx:
+            {(row['First Name'], row['Last Name']): (row[f'Contact Phone {idx}'])},
+            args=(index,),
+            axis=1).tolist()
+
+        for email_dict in emails:
+            for key, value in email_dict.items():
+                candidates.setdefault(key, ([], []))[0].append(value)
+
+        for phone_dict in phones:
+            for key, value in phone_dict.items():
+                candidates.setdefault(key, ([], []))[1].append(value)
+
+    # Normalize every distinct email and phone in one batch, and keep the first valid ones
+    with (Normalizer() if normalizer is None else nullcontext(normalizer)) as normalizer:
+        emails = {email: None for emails, _ in candidates.values() for email in emails}
+        emails = dict(zip(emails, normalizer.emails(emails)))
+        phones = {phone: None for _, phones in candidates.values() for phone in phones}
+        phones = dict(zip(phones, normalizer.phones(phones)))
+
+    for key, (key_emails, key_phones) in candidates.items():
+        result_list[key] = {}
+        if email := next(filter(None, map(emails.get, key_emails)), None):
+            result_list[key]['email'] = email
+        if phone := next(filter(None, map(phones.get, key_phones)), None):
+            result_list[key]['phone'] = phone
+
+    return result_list
@@ -0,0 +1,332 @@
+"""
+Contact Deduplication
+===========
+
+Gives every VIP a normalized identity key so the same person collected from Apollo, Seamless
+and cleanse CSVs is only ever stored once.
+
+The key is built from the lower-cased name plus the domain of the MSP the contact works at.
+It doesn't depend on which contact fields a source happened to fill, so filling in an email or
+phone later never changes who a row is. Domains go through the normalization stage's
+`normalize_domain`, the same one that normalizes the stored URLs, so keys and stored values
+always agree. Company names are normalized the same way to tell which
+MSP a scraped contact works at.
+"""
+from contextlib import closing
+import re
+from normalize import normalize_domain
+
+upsert_vip_sql = (
+    '''INSERT INTO VIPs (MSPID, FirstName, LastName, Title, Email, Phone, IdentityKey) '''
+    '''VALUES (?, ?, ?, ?, ?, ?, ?) '''
+    '''ON CONFLICT(IdentityKey) DO UPDATE SET '''
+    '''MSPID = COALESCE(VIPs.MSPID, excluded.MSPID), '''
+    '''Title = COALESCE(excluded.Title, VIPs.Title), '''
+    '''Email = COALESCE(VIPs.Email, excluded.Email), '''
+    '''Phone = COALESCE(VIPs.Phone, excluded.Phone)''')
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_name(name) -> str:
+    """
+    Lower-cases a name and collapses its whitespace
+
+    :param name: first or last name, may be None
+    :type name: str
+    :return: normalized name
+    :rtype: str
+
+    Example::
+
+        >>> normalize_name('  Mary  Ann ')
+        'mary ann'
+        >>> normalize_name(None)
+        ''
+    """
+    if not name:
+        return ''
+    return _whitespace.sub(' ', str(name)).strip().lower()
+
+
+_company_suffixes = re.compile(
+    r'\b(?:inc|llc|ltd|limited|corp|corporation|co|company|group|plc|gmbh|lp|llp)\b')
+_non_alphanumeric = re.compile(r'[^a-z0-9]+')
+
+# Shortest company key allowed to match as a prefix of a longer one
+_min_prefix_length = 4
+
+
+def normalize_company(company) -> str:
+    """
+    Reduces a company name or domain to a comparable key, dropping legal suffixes, the TLD of
+    domains, punctuation and whitespace
+
+    Example::
+
+        >>> normalize_company('Acme Networks, Inc.')
+        'acmenetworks'
+        >>> normalize_company('acmenetworks.com')
+        'acmenetworks'
+        >>> normalize_company(None)
+        ''
+    """
+    if not company:
+        return ''
+    company = str(company).strip().lower()
+    if ' ' not in company and '.' in company:
+        company = company.removeprefix('www.').rsplit('.', 1)[0]
+    return _non_alphanumeric.sub('', _company_suffixes.sub('', company))
+
+
+def match_company(company, msps):
+    """
+    Returns the id of the MSP a company name belongs to, or None if it matches none or several
+
+    :param company: company name as listed by Seamless
+    :type company: str
+    :param msps: list of (id, name, domain) tuples to match against
+    :type msps: list
+    :rtype: int
+
+    Example::
+
+        >>> msps = [(1, 'Acme Networks', 'acmenet.com'), (2, 'Beta IT', 'betait.io')]
+        >>> match_company('ACME Networks Inc', msps), match_company('betait', msps)
+        (1, 2)
+        >>> match_company('Acme Networks Europe', msps), match_company('Gamma', msps)
+        (1, None)
+        >>> others = [(3, 'Netrix', 'netrix.com'), (4, 'CDW', 'cdw.com')]
+        >>> match_company('Net', others), match_company('Cd', others)
+        (None, None)
+        >>> match_company('Global Acme Networks', msps) is None
+        True
+    """
+    key = normalize_company(company)
+    if not key:
+        return None
+    for msp_id, name, domain in msps:
+        if key in (normalize_company(name), normalize_company(domain)):
+            return msp_id
+
+    # Fall back to one name starting with the other, as long as that's unambiguous and the
+    # shorter one is long enough not to be a fragment of an unrelated name
+    matches = {msp_id for msp_id, name, domain in msps
+               for msp_key in (normalize_company(name), normalize_company(domain))
+               if min(len(msp_key), len(key)) >= _min_prefix_length
+               and (key.startswith(msp_key) or msp_key.startswith(key))}
+    return matches.pop() if len(matches) == 1 else None
+
+
+def identity_key(first_name, last_name, msp_domain=None, msp_id=None) -> str:
+    """
+    Builds the normalized identity key of a contact
+
+    :param first_name: contact's first name
+    :param last_name: contact's last name
+    :param msp_domain: domain of the MSP the contact works at
+    :param msp_id: id of the MSP the contact works at, used when its domain isn't valid
+    :return: identity key
+    :rtype: str
+
+    Example::
+
+        >>> identity_key('Bob', 'Smith', 'acme.com')
+        'bob smith|acme.com'
+        >>> identity_key('BOB ', 'smith', 'https://www.Acme.com/', 7)
+        'bob smith|acme.com'
+        >>> identity_key('Bob', 'Smith', None, 7)
+        'bob smith|msp:7'
+    """
+    name = f'{normalize_name(first_name)} {normalize_name(last_name)}'
+    discriminator = normalize_domain(msp_domain)
+    if not discriminator:
+        discriminator = f'msp:{msp_id}' if msp_id is not None else ''
+    return f'{name}|{discriminator}'
+
+
+def msp_domains(cursor, msp_ids) -> dict:
+    """
+    Returns {id: URL} of the given MSPs
+
+    :param cursor: sqlite3 cursor on MSP.db
+    :param msp_ids: ids of the MSPs
+    :type msp_ids: iterable
+    :rtype: dict
+    """
+    msp_ids = [msp_id for msp_id in set(msp_ids) if msp_id is not None]
+    domains = {}
+    for start in range(0, len(msp_ids), 500):
+        chunk = msp_ids[start:start + 500]
+        domains.update(cursor.execute(
+            f'''SELECT ID, URL FROM MSPs WHERE ID IN ({','.join('?' * len(chunk))})''',
+            chunk).fetchall())
+    return domains
+
+
+def upsert_vips(cursor, rows):
+    """
+    Inserts VIPs, merging into the existing contact when its identity key is already stored
+
+    Existing emails and phones win over incoming ones, incoming titles win over existing ones.
+    MSPs have to be stored before their VIPs, as the key is built from the MSP's domain.
+
+    :param cursor: sqlite3 cursor on MSP.db
+    :param rows: iterable of (MSPID, FirstName, LastName, Title, Email, Phone) tuples
+    :type rows: iterable
+    """
+    rows = list(rows)
+    domains = msp_domains(cursor, (row[0] for row in rows))
+    cursor.executemany(upsert_vip_sql, [
+        tuple(row) + (identity_key(row[1], row[2], domains.get(row[0]), row[0]),)
+        for row in rows])
+
+
+def update_by_name(cursor, first_name, last_name, email=None, phone=None) -> int:
+    """
+    Sets the email and/or phone of the one VIP with a name, as found in cleanse csvs which
+    don't say which MSP a contact works at
+
+    Names are matched by identity key, so case and spacing don't matter. A name held by VIPs
+    at several MSPs is ambiguous and left alone.
+
+    :param cursor: sqlite3 cursor on MSP.db
+    :param first_name: contact's first name
+    :param last_name: contact's last name
+    :param email: email to set, left as is if None
+    :param phone: phone to set, left as is if None
+    :return: number of VIPs with that name
+    :rtype: int
+
+    Example::
+
+        >>> import sqlite3; from migrations import migrate
+        >>> connection = sqlite3.connect(':memory:')
+        >>> migrate(connection) # doctest: +ELLIPSIS
+        Migrating db ...
+        >>> cursor = connection.cursor()
+        >>> _ = cursor.execute("INSERT INTO MSPs (Name, URL) VALUES ('MSP 1', 'msp1.com')")
+        >>> upsert_vips(cursor, [(1, 'Bob', 'Smith', 'CTO', None, None)])
+        >>> update_by_name(cursor, 'bob', 'SMITH', 'bob@msp1.com')
+        1
+        >>> upsert_vips(cursor, [(1, 'Bob', 'Smith', 'CTO', 'bob@msp1.com', None)])
+        >>> cursor.execute('SELECT ID, Email, IdentityKey FROM VIPs').fetchall()
+        [(1, 'bob@msp1.com', 'bob smith|msp1.com')]
+    """
+    prefix = identity_key(first_name, last_name)
+    cursor.execute(
+        '''SELECT ID FROM VIPs WHERE IdentityKey >= ? AND IdentityKey < ? LIMIT 2''',
+        (prefix, prefix[:-1] + '}'))
+    matches = cursor.fetchall()
+    if len(matches) == 1:
+        cursor.execute(
+            '''UPDATE VIPs SET Email = COALESCE(?, Email), Phone = COALESCE(?, Phone) '''
+            '''WHERE ID = ?''', (email, phone, matches[0][0]))
+    return len(matches)
+
+
+def ensure_identity_index(connection):
+    """
+    Adds the IdentityKey column and its unique index to databases created before they existed
+
+    Legacy rows keep a NULL key, which the unique index ignores, until `dedupe_vips` is run.
+
+    :param connection: sqlite3 database connection to MSP.db
+    """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute('''PRAGMA table_info(VIPs)''')
+        if 'IdentityKey' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('''ALTER TABLE VIPs ADD COLUMN IdentityKey TEXT''')
+        cursor.execute(
+            '''CREATE UNIQUE INDEX IF NOT EXISTS VIPs_IdentityKey ON VIPs (IdentityKey)''')
+        connection.commit()
+
+
+def dedupe_vips(connection, batch_size: int = 10000) -> int:
+    """
+    One-shot job collapsing duplicate VIPs and backfilling identity keys
+
+    VIPs is read exactly once, streaming, and the keys are staged in a temp table so grouping,
+    merging and deleting all happen inside SQLite. The oldest row of each identity survives and
+    takes any email, phone or title it was missing from its duplicates.
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param batch_size: number of rows fetched from VIPs at a time
+    :type batch_size: int
+    :return: number of duplicate rows deleted
+    :rtype: int
+
+    Example::
+
+        >>> import sqlite3
+        >>> connection = sqlite3.connect(':memory:')
+        >>> _ = connection.executescript(open('up.sql').read())
+        >>> _ = connection.execute("INSERT INTO MSPs (Name, URL) VALUES ('Acme', 'acme.com')")
+        >>> connection.executemany(
+        ...     'INSERT INTO VIPs (MSPID, FirstName, LastName, Title, Email, Phone) '
+        ...     'VALUES (?, ?, ?, ?, ?, ?)', [
+        ...         (1, 'Bob', 'Smith', 'CTO', None, None),
+        ...         (1, 'bob', 'smith', None, 'b.smith@acme.com', '+15550109999'),
+        ...         (2, 'Ann', 'Lee', 'COO', None, None)]) # doctest: +ELLIPSIS
+        <sqlite3.Cursor object at ...>
+        >>> dedupe_vips(connection)
+        1
+        >>> connection.execute('SELECT FirstName, Email, Phone, IdentityKey FROM VIPs').fetchall()
+        [('Bob', 'b.smith@acme.com', '+15550109999', 'bob smith|acme.com'), ('Ann', None, None, 'ann lee|msp:2')]
+    """
+    ensure_identity_index(connection)
+    with closing(connection.cursor()) as reader, closing(connection.cursor()) as cursor:
+        cursor.execute('''DROP TABLE IF EXISTS temp.VIPKeys''')
+        cursor.execute(
+            '''CREATE TEMP TABLE VIPKeys (ID INTEGER PRIMARY KEY, IdentityKey TEXT NOT NULL)''')
+
+        # Single streaming pass over VIPs
+        reader.execute(
+            '''SELECT V.ID, V.MSPID, V.FirstName, V.LastName, M.URL '''
+            '''FROM VIPs V LEFT JOIN MSPs M ON M.ID = V.MSPID''')
+        while rows := reader.fetchmany(batch_size):
+            cursor.executemany(
+                '''INSERT INTO temp.VIPKeys (ID, IdentityKey) VALUES (?, ?)''',
+                [(vip_id, identity_key(first, last, domain, msp_id))
+                 for (vip_id, msp_id, first, last, domain) in rows])
+        cursor.execute('''CREATE INDEX temp.VIPKeys_IdentityKey ON VIPKeys (IdentityKey, ID)''')
+
+        # Fill in the survivor of each duplicated identity from the rest of its group
+        cursor.execute(
+            '''
+            UPDATE VIPs
+            SET Title = COALESCE(VIPs.Title, Merged.Title),
+                Email = COALESCE(VIPs.Email, Merged.Email),
+                Phone = COALESCE(VIPs.Phone, Merged.Phone)
+            FROM (
+                SELECT MIN(K.ID) AS ID, MAX(V.Title) AS Title, MAX(V.Email) AS Email,
+                       MAX(V.Phone) AS Phone
+                FROM temp.VIPKeys K JOIN VIPs V ON V.ID = K.ID
+                GROUP BY K.IdentityKey
+                HAVING COUNT(*) > 1
+            ) AS Merged
+            WHERE VIPs.ID = Merged.ID
+            ''')
+
+        cursor.execute(
+            '''
+            DELETE FROM VIPs WHERE ID IN (
+                SELECT K.ID FROM temp.VIPKeys K
+                WHERE K.ID > (SELECT MIN(S.ID) FROM temp.VIPKeys S
+                              WHERE S.IdentityKey = K.IdentityKey)
+            )
+            ''')
+        deleted = cursor.rowcount
+
+        # Keys may shift between rows, so rebuild the unique index around the backfill
+        cursor.execute('''DROP INDEX IF EXISTS VIPs_IdentityKey''')
+        cursor.execute(
+            '''
+            UPDATE VIPs SET IdentityKey = K.IdentityKey
+            FROM temp.VIPKeys K
+            WHERE VIPs.ID = K.ID AND VIPs.IdentityKey IS NOT K.IdentityKey
+            ''')
+        cursor.execute('''CREATE UNIQUE INDEX VIPs_IdentityKey ON VIPs (IdentityKey)''')
+        cursor.execute('''DROP TABLE temp.VIPKeys''')
+        connection.commit()
+    return deleted
@@ -1,4 +1,12 @@
 DROP TABLE MSPs;
 
 DROP TABLE VIPs;
-Delete from SQLITE_SEQUENCE where name='VIPs'
\ No newline at end of file
+Delete from SQLITE_SEQUENCE where name='VIPs';
+
+DROP TABLE Jobs;
+
+DROP TABLE RateLimits;
+
+DROP TABLE Credits;
+
+PRAGMA user_version = 0;
@@ -0,0 +1,410 @@
+"""
+Job Queue
+===========
+
+Persistent work queue kept in MSP.db, so enrichment keeps flowing between runs.
+
+Workers claim jobs with a lease, renewed in the background while the job runs, so a job whose
+worker died is picked up again once its lease expires. Workers only ever finish jobs they still
+hold. Failed jobs are retried with exponential backoff, and API rate limits are stored next
+to the queue so a restarted worker doesn't blow through them. Paid credits are kept there too,
+and drawn by jobs from one shared budget.
+"""
+from contextlib import closing
+import json
+import os
+import socket
+import sqlite3
+from threading import Event, Thread
+from time import sleep, time
+import traceback
+
+# Kinds of job workers know how to run
+CRN_REFRESH = 'crn_refresh'
+APOLLO = 'apollo'
+SEAMLESS = 'seamless'
+CLEANSE = 'cleanse'
+
+
+class RateLimited(Exception):
+    """
+    Raised by a job handler when it has to wait for a rate limit, the job is postponed without
+    counting as an attempt
+
+    :param wait: seconds until the job can run
+    :type wait: float
+    """
+
+    def __init__(self, wait: float):
+        self.wait = wait
+        super().__init__(f'Rate limited for {wait} sec')
+
+
+def enqueue(connection, kind: str, payload: dict = None, run_after: float = None) -> bool:
+    """
+    Adds a job to the queue, unless the same job is already waiting or running
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param kind: kind of job, such as APOLLO
+    :type kind: str
+    :param payload: json serializable arguments of the job
+    :type payload: dict
+    :param run_after: unix time before which the job won't be claimed, defaults to now
+    :type run_after: float
+    :return: whether the job was added
+    :rtype: bool
+
+    Example::
+
+        >>> import sqlite3
+        >>> connection = sqlite3.connect(':memory:')
+        >>> _ = connection.executescript(open('up.sql').read())
+        >>> enqueue(connection, APOLLO, {'msp_id': 1})
+        True
+        >>> enqueue(connection, APOLLO, {'msp_id': 1})
+        False
+    """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(
+            '''INSERT OR IGNORE INTO Jobs (Kind, Payload, RunAfter) VALUES (?, ?, ?)''',
+            (kind, json.dumps(payload or {}, sort_keys=True),
+             time() if run_after is None else run_after))
+        connection.commit()
+        return cursor.rowcount > 0
+
+
+def claim(connection, worker: str, lease: float = 600):
+    """
+    Leases the next runnable job to worker
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param worker: name of the worker claiming the job
+    :type worker: str
+    :param lease: seconds before the job may be claimed by another worker
+    :type lease: float
+    :return: (id, kind, payload, attempts) of the job, or None if there is nothing to run
+    :rtype: tuple
+
+    Example::
+
+        >>> import sqlite3
+        >>> connection = sqlite3.connect(':memory:')
+        >>> _ = connection.executescript(open('up.sql').read())
+        >>> enqueue(connection, CLEANSE, {'csv_path': 'cleaned.csv'})
+        True
+        >>> claim(connection, 'a')
+        (1, 'cleanse', {'csv_path': 'cleaned.csv'}, 1)
+        >>> claim(connection, 'b') is None
+        True
+    """
+    now = time()
+    with closing(connection.cursor()) as cursor:
+        # The subquery and update run as one statement, so two workers can't claim the same job
+        cursor.execute(
+            '''
+            UPDATE Jobs
+            SET Status = 'running', Worker = ?, LeaseExpires = ?, Attempts = Attempts + 1
+            WHERE ID = (
+                SELECT ID FROM Jobs
+                WHERE RunAfter <= ?
+                    AND (Status = 'pending' OR (Status = 'running' AND LeaseExpires < ?))
+                ORDER BY RunAfter, ID
+                LIMIT 1
+            )
+            RETURNING ID, Kind, Payload, Attempts
+            ''', (worker, now + lease, now, now))
+        job = cursor.fetchone()
+        connection.commit()
+    if job is None:
+        return None
+    return job[0], job[1], json.loads(job[2]), job[3]
+
+
+def complete(connection, job_id: int, worker: str) -> bool:
+    """
+    Marks a job as done
+
+    :return: whether worker still held the job, nothing is changed if it didn't
+    :rtype: bool
+    """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(
+            '''UPDATE Jobs SET Status = 'done', Worker = NULL, LeaseExpires = NULL '''
+            '''WHERE ID = ? AND Worker = ?''', (job_id, worker))
+        connection.commit()
+        return cursor.rowcount > 0
+
+
+def postpone(connection, job_id: int, worker: str, wait: float, error: str = None,
+             refund: bool = False) -> bool:
+    """
+    Puts a job back in the queue to run in wait seconds
+
+    :param refund: don't count the current run as an attempt
+    :type refund: bool
+    :return: whether worker still held the job, nothing is changed if it didn't
+    :rtype: bool
+    """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(
+            '''
+            UPDATE Jobs
+            SET Status = 'pending', Worker = NULL, LeaseExpires = NULL, RunAfter = ?,
+                LastError = COALESCE(?, LastError), Attempts = Attempts - ?
+            WHERE ID = ? AND Worker = ?
+            ''', (time() + wait, error, int(refund), job_id, worker))
+        connection.commit()
+        return cursor.rowcount > 0
+
+
+def fail(connection, job_id: int, worker: str, attempts: int, error: str, max_attempts: int = 5,
+         backoff: float = 60, max_backoff: float = 6 * 60 * 60) -> bool:
+    """
+    Schedules a failed job to be retried with exponential backoff, or gives up on it
+
+    :return: whether worker still held the job, nothing is changed if it didn't
+    :rtype: bool
+
+    Example::
+
+        >>> import sqlite3
+        >>> connection = sqlite3.connect(':memory:')
+        >>> _ = connection.executescript(open('up.sql').read())
+        >>> enqueue(connection, CRN_REFRESH)
+        True
+        >>> job_id, _, _, attempts = claim(connection, 'a')
+        >>> fail(connection, job_id, 'a', attempts, 'timeout', max_attempts=2)
+        True
+        >>> connection.execute('SELECT Status, RunAfter - ? > 59 FROM Jobs', (time(),)).fetchone()
+        ('pending', 1)
+        >>> connection.execute('UPDATE Jobs SET RunAfter = 0') and None
+        >>> job_id, _, _, attempts = claim(connection, 'a')
+        >>> fail(connection, job_id, 'b', attempts, 'timeout', max_attempts=2)
+        False
+        >>> fail(connection, job_id, 'a', attempts, 'timeout', max_attempts=2)
+        True
+        >>> connection.execute('SELECT Status, Attempts, LastError FROM Jobs').fetchone()
+        ('failed', 2, 'timeout')
+    """
+    if attempts >= max_attempts:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(
+                '''UPDATE Jobs SET Status = 'failed', Worker = NULL, LeaseExpires = NULL, '''
+                '''LastError = ? WHERE ID = ? AND Worker = ?''', (error, job_id, worker))
+            connection.commit()
+            return cursor.rowcount > 0
+    return postpone(connection, job_id, worker, min(backoff * 2 ** (attempts - 1), max_backoff),
+                    error)
+
+
+def renew(connection, job_id: int, worker: str, lease: float = 600) -> bool:
+    """
+    Extends the lease worker holds on a running job
+
+    :return: whether worker still held the job
+    :rtype: bool
+    """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(
+            '''UPDATE Jobs SET LeaseExpires = ? '''
+            '''WHERE ID = ? AND Worker = ? AND Status = 'running' ''',
+            (time() + lease, job_id, worker))
+        connection.commit()
+        return cursor.rowcount > 0
+
+
+def _keep_leased(database: str, job_id: int, worker: str, lease: float, done: Event):
+    """
+    Renews a job's lease every third of it until done is set, on its own connection so it
+    keeps going while the job sleeps on a rate limit or holds the worker's connection
+    """
+    with closing(sqlite3.connect(database, timeout=lease / 3)) as connection:
+        while not done.wait(lease / 3):
+            try:
+                if not renew(connection, job_id, worker, lease):
+                    return
+            except sqlite3.OperationalError as error:
+                print(f'Could not renew the lease on job #{job_id}, retrying: {error}')
+
+
+def load_rate_limit(connection, name: str, requests_left):
+    """
+    Restores the stored rate limit of an API into requests_left, and returns how many seconds
+    to wait before it can be requested again
+
+    Windows that have rolled over since the limit was stored are assumed to have reset.
+
+    :param name: name of the API, such as 'apollo'
+    :type name: str
+    :param requests_left: RequestRemaining of the API, updated in place
+    :return: seconds to wait, 0 if a request can be made now
+    :rtype: float
+
+    Example::
+
+        >>> import sqlite3; from apollo import RequestRemaining
+        >>> connection = sqlite3.connect(':memory:')
+        >>> _ = connection.executescript(open('up.sql').read())
+        >>> save_rate_limit(connection, 'apollo', RequestRemaining(0, 10, 100))
+        >>> limit = RequestRemaining(1, 1, 1)
+        >>> 59 < load_rate_limit(connection, 'apollo', limit) <= 60, limit
+        (True, RequestRemaining(minute=0, hour=10, day=100))
+        >>> _ = connection.execute("UPDATE RateLimits SET Observed = Observed - 61")
+        >>> load_rate_limit(connection, 'apollo', limit), limit
+        (0, RequestRemaining(minute=1, hour=10, day=100))
+    """
+    row = connection.execute(
+        '''SELECT Minute, Hour, Day, Observed FROM RateLimits WHERE Name = ?''',
+        (name,)).fetchone()
+    if row is None:
+        return 0
+    minute, hour, day, observed = row
+    elapsed = time() - observed
+    requests_left.minute = max(minute, 1) if elapsed >= 60 else minute
+    requests_left.hour = max(hour, 1) if elapsed >= 60 * 60 else hour
+    requests_left.day = max(day, 1) if elapsed >= 24 * 60 * 60 else day
+    if requests_left.can_request():
+        return 0
+    return max(requests_left.next_request() - elapsed, 0)
+
+
+def save_rate_limit(connection, name: str, requests_left):
+    """Stores the rate limit of an API, as last reported by its response headers"""
+    connection.execute(
+        '''INSERT OR REPLACE INTO RateLimits (Name, Minute, Hour, Day, Observed) '''
+        '''VALUES (?, ?, ?, ?, ?)''',
+        (name, requests_left.minute, requests_left.hour, requests_left.day, time()))
+    connection.commit()
+
+
+def set_credits(connection, name: str, credits: int):
+    """Sets how many credits of a paid API are left to spend, across all jobs and runs"""
+    connection.execute('''INSERT OR REPLACE INTO Credits (Name, Remaining) VALUES (?, ?)''',
+                       (name, credits))
+    connection.commit()
+
+
+def draw_credits(connection, name: str, wanted: int) -> int:
+    """
+    Takes up to wanted credits of a paid API out of what's left, return the unspent ones with
+    `return_credits`
+
+    Credits are drawn and any overdraw given back with single statement updates, so concurrent
+    workers never draw the same credits between them.
+
+    :param name: name of the API, such as 'seamless'
+    :type name: str
+    :param wanted: most credits to take
+    :type wanted: int
+    :return: credits taken, 0 once none are left or none were ever set
+    :rtype: int
+
+    Example::
+
+        >>> import sqlite3; from migrations import migrate
+        >>> connection = sqlite3.connect(':memory:')
+        >>> migrate(connection) # doctest: +ELLIPSIS
+        Migrating db ...
+        >>> set_credits(connection, 'seamless', 100)
+        >>> [draw_credits(connection, 'seamless', 60) for _ in range(3)]
+        [60, 40, 0]
+        >>> return_credits(connection, 'seamless', 15)
+        >>> draw_credits(connection, 'seamless', 60), draw_credits(connection, 'apollo', 60)
+        (15, 0)
+    """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(
+            '''UPDATE Credits SET Remaining = Remaining - ? WHERE Name = ? RETURNING Remaining''',
+            (wanted, name))
+        row = cursor.fetchone()
+        drawn = 0 if row is None else max(min(wanted, wanted + row[0]), 0)
+        connection.commit()
+    if row is not None and drawn < wanted:
+        return_credits(connection, name, wanted - drawn)
+    return drawn
+
+
+def return_credits(connection, name: str, credits: int):
+    """Gives back credits drawn with `draw_credits` that weren't spent"""
+    connection.execute('''UPDATE Credits SET Remaining = Remaining + ? WHERE Name = ?''',
+                       (credits, name))
+    connection.commit()
+
+
+def default_worker_name() -> str:
+    """Names a worker after its host and process"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def work(connection, handlers: dict, worker: str = None, poll: float = 5, lease: float = 600,
+         max_attempts: int = 5, once: bool = False):
+    """
+    Runs jobs from the queue until interrupted
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param handlers: dictionary of {kind: function(connection, payload)}
+    :type handlers: dict
+    :param worker: name of this worker, defaults to host:pid
+    :type worker: str
+    :param poll: seconds to wait when the queue is empty
+    :type poll: float
+    :param lease: seconds a job can go without its lease being renewed before another worker can
+        reclaim it
+    :type lease: float
+    :param max_attempts: attempts before a job is marked failed
+    :type max_attempts: int
+    :param once: return once the queue has nothing runnable, instead of polling
+    :type once: bool
+
+    Example::
+
+        >>> import sqlite3
+        >>> connection = sqlite3.connect(':memory:')
+        >>> _ = connection.executescript(open('up.sql').read())
+        >>> for csv_path in ('a.csv', 'b.csv'):
+        ...     _ = enqueue(connection, CLEANSE, {'csv_path': csv_path})
+        >>> work(connection, {CLEANSE: lambda _, payload: print(payload['csv_path'])},
+        ...      'worker', once=True)
+        worker running cleanse job #1 {'csv_path': 'a.csv'}, attempt 1
+        a.csv
+        worker running cleanse job #2 {'csv_path': 'b.csv'}, attempt 1
+        b.csv
+        >>> connection.execute("SELECT COUNT(*) FROM Jobs WHERE Status = 'done'").fetchone()
+        (2,)
+    """
+    worker = worker or default_worker_name()
+    # In-memory dbs can't be opened again to renew leases, and only have the one worker anyway
+    database = connection.execute('''PRAGMA database_list''').fetchone()[2]
+    while True:
+        job = claim(connection, worker, lease)
+        if job is None:
+            if once:
+                return
+            sleep(poll)
+            continue
+
+        job_id, kind, payload, attempts = job
+        print(f'{worker} running {kind} job #{job_id} {payload}, attempt {attempts}')
+        done = Event()
+        if database:
+            Thread(target=_keep_leased, args=(database, job_id, worker, lease, done),
+                   daemon=True).start()
+        try:
+            handlers[kind](connection, payload)
+        except RateLimited as limited:
+            print(f'{kind} job #{job_id} rate limited, retrying in {limited.wait} sec')
+            held = postpone(connection, job_id, worker, limited.wait, refund=True)
+        except KeyboardInterrupt:
+            postpone(connection, job_id, worker, 0, refund=True)
+            raise
+        except Exception:
+            connection.rollback()
+            error = traceback.format_exc()
+            print(f'{kind} job #{job_id} failed\n{error}')
+            held = fail(connection, job_id, worker, attempts, error, max_attempts)
+        else:
+            held = complete(connection, job_id, worker)
+        finally:
+            done.set()
+        if not held:
+            print(f'{kind} job #{job_id} was reclaimed by another worker, leaving it to them')
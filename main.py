@@ -1,3 +1,57 @@
+"""
+MSPScrape CLI
+===========
+
+Each subcommand imports only what it needs, so exporting or deduping never pays for (or needs)
+requests, selenium, pandas or phonenumbers.
+
+Heavy modules each subcommand loads before it starts running, none of them::
+
+    >>> import os, subprocess, sys
+    >>> here = os.path.dirname(os.path.abspath(__file__))
+    >>> for argv in (['msps'], ['vips'], ['seamless', '10'], ['cleanse', 'cleaned.csv'],
+    ...              ['export', '--all', '-o', 'all.csv'], ['normalize'], ['enqueue', 'apollo'],
+    ...              ['worker', '--once'], ['shard', '0', '2', 'shard_0.db'],
+    ...              ['merge', 'shard_0.db'], ['dedupe']):
+    ...     out = subprocess.run(
+    ...         [sys.executable, '-c', 'import sys, main; '
+    ...          f'main.build_parser().parse_args({argv!r}); '
+    ...          'print([m for m in main.heavy_modules if m in sys.modules])'],
+    ...         cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+    ...     print(argv[0], out)
+    msps []
+    vips []
+    seamless []
+    cleanse []
+    export []
+    normalize []
+    enqueue []
+    worker []
+    shard []
+    merge []
+    dedupe []
+
+Loading a cleanse csv doesn't need selenium or a browser::
+
+    >>> print(subprocess.run(
+    ...     [sys.executable, '-c', 'import sys, cleanse; print("selenium" in sys.modules)'],
+    ...     cwd=here, capture_output=True, text=True, check=True).stdout.strip())
+    False
+
+The offline subcommands run end to end on a fresh db::
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     for argv in (['dedupe'], ['export', '--all', '-o', os.path.join(tmp, 'all.csv')],
+    ...                  ['export', '--missing', '-o', os.path.join(tmp, 'missing.csv')]):
+    ...         done = subprocess.run([sys.executable, os.path.join(here, 'main.py'),
+    ...                                '--db', os.path.join(tmp, 'MSP.db')] + argv,
+    ...                               capture_output=True)
+    ...         print(argv[0], done.returncode)
+    dedupe 0
+    export 0
+    export 0
+"""
 from contextlib import closing
 import os
 import sys
@@ -6,24 +60,36 @@ import warnings
 import argparse
 import sqlite3
 import csv
-import requests
-from lxml import html
-from dotenv import load_dotenv
-from apollo import ApolloAPI
-from seamless import Seamless
-
-# List of titles to search
-titles = [
-    # 'Chief Executive Officer', 'CEO',
-    # 'Chief Product Officer', 'CPO',
-    'Chief Innovation Officer', 'CIO',
-    'VP operations', 'VP of operations', 'VPO',
-    'Chief Operating Officer', ' COO',
-    'Chief Technology Officer', 'CTO'
-]
+from roles import TitleMatcher
+from contacts import dedupe_vips, match_company, update_by_name, upsert_vips
+from migrations import migrate
+from normalize import Normalizer, normalize_domain
+import jobs
+import shards
+
+# Roles we want, and the broad titles searched to find them
+matcher = TitleMatcher()
+titles = matcher.query_titles
+
+# Slow to import, only ever loaded by the subcommand that needs them
+heavy_modules = ('requests', 'lxml', 'dotenv', 'selenium', 'pandas', 'phonenumbers', 'apollo',
+                 'seamless', 'cleanse')
 
 
 def get_msps(connection, over_write):
+    """
+    Scrapes CRN's top 500 MSPs into the MSPs table
+
+    Without over_write MSPs are refreshed in place, matched by URL, so they keep the ids their
+    VIPs and queued jobs point at. Never prompts, so it can run from a worker.
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param over_write: wipes the MSPs table and restarts its ids, after a countdown
+    :type over_write: bool
+    """
+    import requests
+    from lxml import html
+
     with closing(connection.cursor()) as cursor:
 
         # Wipe table and increment counter
@@ -38,9 +104,6 @@ def get_msps(connection, over_write):
             cursor.execute('''Delete from MSPs''')
             cursor.execute('''Delete from SQLITE_SEQUENCE where name='MSPs' ''')
             print('Deleted')
-        else:
-            print('MSPs refresh does not implement resuming at this time, please wipe DB')
-            return
 
         # Parse page containing top 500 MSPs
         tree = html.fromstring(requests.get('https://www.crn.com/rankings-and-lists/msp2023.htm',
@@ -64,20 +127,58 @@ def get_msps(connection, over_write):
 
             print(msp)
 
+        # Store bare domain.tld, falling back to the scraped url if it isn't a valid domain
+        msps = [(name, domain or url) for (name, url), domain in
+                zip(msps, Normalizer().domains(url for _, url in msps))]
+
         # Insert info about MSPs into our DB
-        cursor.executemany('''insert into MSPs (Name, URL) values (?, ?)''', msps)
+        upsert_msps(cursor, msps)
         connection.commit()
 
 
-def get_vips(connection, over_write: bool = False):
+def upsert_msps(cursor, msps: list):
+    """
+    Stores MSPs, renaming the ones whose URL is already stored instead of adding them again
+
+    Stored URLs are compared by their normalized domain, so MSPs stored before URLs were
+    normalized, such as 'acme.com/', are still matched.
+
+    :param cursor: sqlite3 cursor on MSP.db
+    :param msps: list of (name, domain.tld) of the MSPs
+    :type msps: list
+
+    Example::
+
+        >>> connection = sqlite3.connect(':memory:'); migrate(connection) # doctest: +ELLIPSIS
+        Migrating db ...
+        >>> cursor = connection.cursor()
+        >>> upsert_msps(cursor, [('Acme', 'acme.com/'), ('Initech', 'https://initech.com')])
+        >>> upsert_msps(cursor, [('Globex', 'globex.com'), ('Acme Inc', 'acme.com'),
+        ...                      ('Initech', 'initech.com')])
+        >>> cursor.execute('SELECT ID, Name, URL FROM MSPs').fetchall()
+        [(1, 'Acme Inc', 'acme.com'), (2, 'Initech', 'initech.com'), (3, 'Globex', 'globex.com')]
     """
-    Collects VIPs in database
+    ids = {normalize_domain(url) or url: msp_id
+           for url, msp_id in cursor.execute('''SELECT URL, ID FROM MSPs''').fetchall()}
+    msps = [(name, url, ids.get(normalize_domain(url) or url)) for name, url in msps]
+    cursor.executemany('''UPDATE MSPs SET Name = ?, URL = ? WHERE ID = ?''',
+                       [msp for msp in msps if msp[2] is not None])
+    cursor.executemany('''INSERT INTO MSPs (Name, URL) VALUES (?, ?)''',
+                       [(name, url) for name, url, msp_id in msps if msp_id is None])
+
+
+def get_vips(connection, over_write: bool = False, api=None):
+    """
+    Collects VIPs in database, for every MSP that has none yet
 
     :param connection: sqlite3 database connection to MSP.db
     :param over_write: will wipe table and rewrite if true
+    :param api: ApolloAPI to query, one is made from APOLLO_API_KEY if not given
     """
-    with closing(connection.cursor()) as cursor:
-        api = ApolloAPI(os.getenv('APOLLO_API_KEY'))
+    with closing(connection.cursor()) as cursor, Normalizer() as normalizer:
+        if api is None:
+            from apollo import ApolloAPI
+            api = ApolloAPI(os.getenv('APOLLO_API_KEY'))
 
         # Wipe table and increment counter
         if over_write:
@@ -92,222 +193,476 @@ def get_vips(connection, over_write: bool = False):
             cursor.execute('''Delete from SQLITE_SEQUENCE where name='VIPs' ''')
             print('Deleted')
 
-        # Get all MSPs, so we can get people data about all of them
-        cursor.execute("SELECT * FROM MSPs")
+        # Resume by skipping each MSP that already has VIPs, however the ids are ordered
+        cursor.execute('''SELECT COUNT(*) FROM MSPs''')
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            '''SELECT ID, URL FROM MSPs '''
+            '''WHERE NOT EXISTS (SELECT 1 FROM VIPs WHERE VIPs.MSPID = MSPs.ID) ORDER BY ID''')
         rows = cursor.fetchall()
+        if len(rows) < total:
+            print(f'Skipping {total - len(rows)} MSPs that already have VIPs')
 
-        cursor.execute('''SELECT MAX(msp_id) FROM VIPs;''')
-        start_index = cursor.fetchone()[0]
-        if start_index is not None and over_write is False:
-            print(f'Start index is {start_index}, skipping written entries')
-        else:
-            start_index = -1
+        for (msp_id, url) in rows:
+            store_apollo_vips(connection, api, normalizer, msp_id, url)
 
-        for (msp_id, url) in [(row[0], row[2]) for row in rows]:
 
-            if msp_id <= start_index:
-                print(f'Skipped msp_id #{msp_id}')
-                continue
+def store_apollo_vips(connection, api, normalizer, msp_id: int, url: str) -> int:
+    """
+    Collects one MSP's VIPs from Apollo and stores them
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param api: ApolloAPI to query
+    :param normalizer: Normalizer for the VIPs emails and phones
+    :param msp_id: id of the MSP
+    :type msp_id: int
+    :param url: domain.tld of the MSP
+    :type url: str
+    :return: number of VIPs stored
+    :rtype: int
+    """
+    with closing(connection.cursor()) as cursor:
+        # Collect the VIPs's info, keeping only people who hold one of our roles
+        people = matcher.rank(api.get_people_filtered(url, titles),
+                              lambda person: person.title)
+
+        # Apollo might not have info to return, so just move on to the next
+        if len(people) == 0:
+            warnings.warn(f'No VIPs returned for (url, titles) pair: {url}, {titles}',
+                          UserWarning)
+            return 0
+
+        # Parse info and store it in our db
+        data = [
+            (
+                msp_id, person.first_name, person.last_name, person.title,
+                email, phone) for person, email, phone in zip(
+                people,
+                normalizer.emails(person.email for person in people),
+                normalizer.phones(person.phone for person in people))]
+
+        upsert_vips(cursor, [point[:-1] + (None,) for point in data])
+        cursor.execute(
+            '''UPDATE MSPs SET CompanyNumber=(?) where MSPs.id=(?)''', (data[0][-1], msp_id))
+        connection.commit()
+        print('Transactions committed to db')
+        print(f'Stored VIPs, org number {msp_id}')
+        return len(data)
+
+
+def get_missed_msps(cursor) -> list:
+    """
+    Returns every MSP that we have no VIPs for
+
+    :param cursor: sqlite3 cursor on MSP.db
+    :return: list of MSPs rows, the column names are left in cursor.description
+    :rtype: list
+
+    Example::
+
+        >>> connection = sqlite3.connect(':memory:'); migrate(connection) # doctest: +ELLIPSIS
+        Migrating db ...
+        >>> cursor = connection.cursor()
+        >>> _ = cursor.execute("INSERT INTO MSPs (ID, Name, URL) VALUES (1, 'Acme', 'acme.com'), "
+        ...                    "(501, 'Globex', 'globex.com')")
+        >>> upsert_vips(cursor, [(1, 'Bob', 'Smith', 'CTO', None, None)])
+        >>> get_missed_msps(cursor)
+        [(501, 'Globex', 'globex.com', None)]
+    """
+    cursor.execute(
+        '''SELECT * FROM main.MSPs '''
+        '''WHERE NOT EXISTS (SELECT 1 FROM VIPs WHERE VIPs.MSPID = MSPs.ID) ORDER BY ID''')
+    return cursor.fetchall()
+
+
+def scrape_seamless(connection, credits_remaining: int, batch_size: int = 10,
+                    max_url_length: int = 2000):
+    """
+    Scrapes Seamless for VIPs of every MSP Apollo had no VIPs for, searching several MSPs per
+    page load
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param credits_remaining: number of Seamless credits allowed to be spent
+    :type credits_remaining: int
+    :param batch_size: most MSPs searched at once, 1 searches each MSP on its own
+    :type batch_size: int
+    :param max_url_length: longest search url allowed
+    :type max_url_length: int
+    """
+    from seamless import Seamless
+
+    with closing(connection.cursor()) as cursor, Normalizer() as normalizer:
+        msps = {url: (msp_id, name, url) for (msp_id, name, url, _) in get_missed_msps(cursor)}
+        batches = Seamless.batch_companies(list(msps), titles, batch_size, max_url_length)
+        print(f'Searching {len(msps)} MSPs in {len(batches)} searches')
+        with Seamless(os.getenv('SEAMLESS_USER'), os.getenv('SEAMLESS_PASS')) as scraper:
+            for batch in batches:
+                if credits_remaining <= 0:
+                    print('Out of credits, stopping')
+                    break
+                credits_remaining -= store_seamless_vips(
+                    cursor, scraper, normalizer, [msps[url] for url in batch], credits_remaining)
+                print(f'{credits_remaining} credits remaining after {", ".join(batch)}')
+                connection.commit()
 
-            # Collect the VIPs's info
-            people = api.get_people_filtered(url, titles)
 
-            # Apollo might not have info to return, so just move on to the next
-            if len(people) == 0:
-                warnings.warn(f'No VIPs returned for (url, titles) pair: {url}, {titles}',
-                              UserWarning)
+def store_seamless_vips(cursor, scraper, normalizer, msps: list, credit_budget: int) -> int:
+    """
+    Scrapes VIPs of one or more MSPs from Seamless in a single search and stores them under
+    the MSP each one works at, without committing
+
+    :param cursor: sqlite3 cursor on MSP.db
+    :param scraper: Seamless scraper to use
+    :param normalizer: Normalizer for the VIPs emails
+    :param msps: list of (id, name, domain.tld) of the MSPs to search
+    :type msps: list
+    :param credit_budget: number of Seamless credits allowed to be spent
+    :type credit_budget: int
+    :return: number of credits spent
+    :rtype: int
+    """
+    data = scraper.seamless_scrape_vips([url for _, _, url in msps], titles, credit_budget)
+    results = matcher.rank(data[0], lambda result: result[2])
+
+    rows = []
+    emails = normalizer.emails(result[3] for result in results)
+    for (first_name, last_name, title, _, company), email in zip(results, emails):
+        msp_id = msps[0][0] if len(msps) == 1 else match_company(company, msps)
+        if msp_id is None:
+            warnings.warn(f'Could not match company {company} of {first_name} {last_name} to '
+                          f'one of {[name for _, name, _ in msps]}', UserWarning)
+            continue
+        rows.append((msp_id, first_name, last_name, title, email, None))
+
+    print(f'Inserting {len(rows)} contacts for {", ".join(name for _, name, _ in msps)}')
+    upsert_vips(cursor, rows)
+    return data[1]
+
+
+def load_cleaned(connection, csv_path: str):
+    """
+    Updates VIPs emails and phones from a Seamless cleanse csv
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param csv_path: full path, including file, of csv to load
+    :type csv_path: str
+    """
+    from cleanse import extract_cleaned
+
+    with closing(connection.cursor()) as cursor:
+        data = extract_cleaned(csv_path, 70)
+        for key, value in data.items():
+            if not (value.get('email', False) or value.get('phone', False)):
+                print(f'value {value}  did not have phone or email')
                 continue
+            matches = update_by_name(cursor, key[0], key[1], value.get('email') or None,
+                                     value.get('phone') or None)
+            if matches == 1:
+                print("Update was successful.")
+            elif matches:
+                print(f'{key[0]} {key[1]} works at several MSPs, skipped as ambiguous.')
+            else:
+                print("No rows were affected. The update may not have matched any records.")
+        connection.commit()
 
-            # Parse info and store it in our db
-            data = [
-                (
-                    msp_id, person['first_name'], person['last_name'], person['title'],
-                    person['email'],
-                    person['phone_numbers'][0]['sanitized_number']) for person in people]
 
-            cursor.executemany(
-                '''insert into VIPs (MSPID, FirstName, LastName, Title, Email) '''
-                '''values ( ?, ?, ?, ?, ?)''', [point[:-1] for point in data])
-            cursor.execute(
-                '''UPDATE MSPs SET CompanyNumber=(?) where MSPs.id=(?)''', (data[0][-1], msp_id))
-            connection.commit()
-            print('Transactions committed to db')
-            print(f'Stored VIPs, org number {msp_id}')
+def normalize_db(connection, workers: int = None):
+    """
+    Backfills normalized emails, phones and domains over the whole db
 
+    Values that don't normalize are left as they are.
 
-def main():
-    # Get secrets
-    load_dotenv()
+    :param connection: sqlite3 database connection to MSP.db
+    :param workers: number of worker processes, defaults to the number of cores
+    :type workers: int
+    """
+    with closing(connection.cursor()) as cursor, Normalizer(workers) as normalizer:
+        cursor.execute('''SELECT ID, Email, Phone FROM VIPs''')
+        vips = cursor.fetchall()
+        cursor.executemany(
+            '''UPDATE VIPs SET Email = COALESCE(?, Email), Phone = COALESCE(?, Phone) '''
+            '''WHERE ID = ?''',
+            zip(normalizer.emails(vip[1] for vip in vips),
+                normalizer.phones(vip[2] for vip in vips),
+                (vip[0] for vip in vips)))
+
+        cursor.execute('''SELECT ID, URL, CompanyNumber FROM MSPs''')
+        msps = cursor.fetchall()
+        cursor.executemany(
+            '''UPDATE MSPs SET URL = COALESCE(?, URL), CompanyNumber = COALESCE(?, CompanyNumber) '''
+            '''WHERE ID = ?''',
+            zip(normalizer.domains(msp[1] for msp in msps),
+                normalizer.phones(msp[2] for msp in msps),
+                (msp[0] for msp in msps)))
+        connection.commit()
+        print(f'Normalized {len(vips)} VIPs and {len(msps)} MSPs')
 
-    # Spin up db connection, and auto close on scope exit
-    with closing(sqlite3.connect('MSP.db')) as connection:
 
-        # Create tables if they don't exist
-        with closing(connection.cursor()) as cursor:
-            with open('up.sql', 'r') as sql_file:
-                sql_script = sql_file.read()
-                cursor.executescript(sql_script)
-                connection.commit()
+def export_csv(connection, output_dir: str, missing: bool = False):
+    """
+    Exports the db as csv
 
-        # Save top 500 MSPs to MSPs table in db
-        if args.refresh_msps or args.wipe:
-            get_msps(connection)
+    :param connection: sqlite3 database connection to MSP.db
+    :param output_dir: full path to file location, with filename
+    :type output_dir: str
+    :param missing: export MSPs we have no VIPs for, instead of all contacts
+    :type missing: bool
+    """
+    with closing(connection.cursor()) as cursor:
+        if missing:
+            data = get_missed_msps(cursor)
         else:
-            print('Skipping MSP table update...')
+            cursor.execute(
+                '''
+                SELECT MSPs.ID, MSPs.Name, URL, CompanyNumber, VP.ID, FirstName, LastName, Title, Email, Phone
+                FROM MSPs
+                LEFT JOIN VIPs VP on MSPs.ID = VP.MSPID
+                WHERE 
+                    Name IS NOT NULL
+                    AND FirstName IS NOT NULL
+                    AND LastName IS NOT NULL
+                    AND Email IS NOT NULL
+                ''')
+            data = cursor.fetchall()
+
+        with open(output_dir, 'w', newline='') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(
+                [i[0] for i in cursor.description])  # Write the column headers
+            csv_writer.writerows(data)
+
+
+class JobHandlers(dict):
+    """
+    Runs queued jobs for a worker, keeping its Apollo client, Seamless browser and normalizer
+    alive between jobs
 
-        # Get vips info and save to db
-        if args.refresh_vips or args.wipe:
-            get_vips(connection, args.wipe)
-        else:
-            print('Skipping VIPs table update...')
+    Exit to close the Seamless browser, if one was opened.
+    """
 
+    def __init__(self):
+        from apollo import ApolloAPI
+
+        super().__init__({
+            jobs.CRN_REFRESH: self.crn_refresh,
+            jobs.APOLLO: self.apollo,
+            jobs.SEAMLESS: self.seamless,
+            jobs.CLEANSE: self.cleanse,
+        })
+        self.api = ApolloAPI(os.getenv('APOLLO_API_KEY'))
+        self.normalizer = Normalizer()
+        self.scraper = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.scraper is not None:
+            self.scraper.__exit__(exc_type, exc_val, exc_tb)
+        self.normalizer.__exit__(exc_type, exc_val, exc_tb)
+
+    @staticmethod
+    def crn_refresh(connection, payload):
+        """Rescrapes the MSPs list in place, then queues Apollo enrichment for every MSP"""
+        get_msps(connection, False)
+        for (msp_id,) in connection.execute('''SELECT ID FROM MSPs''').fetchall():
+            jobs.enqueue(connection, jobs.APOLLO, {'msp_id': msp_id})
+
+    def apollo(self, connection, payload):
+        """Enriches one MSP from Apollo, within the rate limit stored by earlier runs"""
+        if wait := jobs.load_rate_limit(connection, 'apollo', self.api.requests_left):
+            raise jobs.RateLimited(wait)
+        msp = connection.execute('''SELECT URL FROM MSPs WHERE ID = ?''',
+                                 (payload['msp_id'],)).fetchone()
+        try:
+            if msp is not None:
+                store_apollo_vips(connection, self.api, self.normalizer, payload['msp_id'],
+                                  msp[0])
+        finally:
+            jobs.save_rate_limit(connection, 'apollo', self.api.requests_left)
+
+    def seamless(self, connection, payload):
+        """
+        Scrapes one MSP from Seamless if it still has no VIPs, spending at most the job's
+        credits out of the budget shared by every Seamless job
+        """
+        msp = connection.execute(
+            '''SELECT Name, URL FROM MSPs WHERE ID = ? '''
+            '''AND NOT EXISTS (SELECT 1 FROM VIPs WHERE VIPs.MSPID = MSPs.ID)''',
+            (payload['msp_id'],)).fetchone()
+        if msp is None:
+            return
+        drawn = jobs.draw_credits(connection, jobs.SEAMLESS, payload['credits'])
+        if not drawn:
+            print(f'No Seamless credits left for MSP #{payload["msp_id"]}, '
+                  f'add more with enqueue seamless --credits')
+            return
+        if self.scraper is None:
+            from seamless import Seamless
+            self.scraper = Seamless(os.getenv('SEAMLESS_USER'), os.getenv('SEAMLESS_PASS'))
+        # Credits drawn for a scrape that failed may have been spent, so only successful jobs
+        # give back what they didn't use
         with closing(connection.cursor()) as cursor:
-            if args.seamless_update is not None:
-                credits_remaining = args.seamless_update
-                with Seamless(os.getenv('SEAMLESS_USER'), os.getenv('SEAMLESS_PASS')) as scraper:
-                    # get missing MSPs
-                    cursor.execute("WITH Numbers AS ("
-                                   "SELECT 1 AS num "
-                                   "UNION ALL "
-                                   "SELECT num + 1 "
-                                   "FROM Numbers "
-                                   "WHERE num < 500"
-                                   ") "
-                                   "SELECT num "
-                                   "FROM Numbers "
-                                   "LEFT JOIN VIPs ON Numbers.num = VIPs.MSPID "
-                                   "WHERE VIPs.MSPID IS NULL;")
-                    keys = [key[0] for key in cursor.fetchall()]
-                    cursor.execute(
-                        f"SELECT * FROM main.MSPs WHERE ID IN ({','.join(map(str, keys))});")
-                    missed_msps = cursor.fetchall()
-                    for (msp_id, name, url, _) in missed_msps:
-                        data = scraper.seamless_scrape_vips([url], titles, credits_remaining)
-                        credits_remaining -= data[1]
-                        results = data[0]
-                        print(f'Inserting {len(results)} contacts for {name}, {credits_remaining} '
-                              f'credits remaining')
-                        cursor.executemany(
-                            '''insert into VIPs (MSPID, FirstName, LastName, Title, Email) '''
-                            '''values ( ?, ?, ?, ?, ?)''',
-                            [(msp_id,) + result for result in results])
-            else:
-                print("Not scraping seamless")
-
-            if args.clean_csv is not None:
-                data = Seamless.extract_cleaned(args.clean_csv, 70)
-                for key, value in data.items():
-                    if value.get('email', False):
-                        if value.get('phone', False):
-                            # both
-                            cursor.execute(
-                                'UPDATE VIPs SET (Phone, Email) = (?,?) '
-                                'WHERE FirstName = ? AND LastName = ?'
-                                , (value.get('phone'), value.get('email'), key[0], key[1]))
-                            if connection.total_changes > 0:
-                                print("Update was successful.")
-                            else:
-                                print(
-                                    "No rows were affected. The update may not have matched any records.")
-                        # only email
-                        else:
-                            cursor.execute(
-                                'UPDATE VIPs SET Email = ? '
-                                'WHERE FirstName = ? AND LastName = ?'
-                                , (value.get('email'), key[0], key[1]))
-                            if connection.total_changes > 0:
-                                print("Update was successful.")
-                            else:
-                                print(
-                                    "No rows were affected. The update may not have matched any records.")
-                    else:
-                        if value.get('phone', False):
-                            # only phone
-                            cursor.execute(
-                                'UPDATE VIPs SET Phone = ? '
-                                'WHERE FirstName = ? AND LastName = ?'
-                                , (value.get('phone'), key[0], key[1]))
-                            if connection.total_changes > 0:
-                                print("Update was successful.")
-                            else:
-                                print(
-                                    "No rows were affected. The update may not have matched any records.")
-                        else:
-                            print(f'value {value}  did not have phone or email')
-                connection.commit()
-            else:
-                print("No cleaned data")
-
-            if args.output_dir is not None:
-                # Export db as csv
-                if args.output_all:
-                    cursor.execute(
-                        '''
-                        SELECT MSPs.ID, MSPs.Name, URL, CompanyNumber, VP.ID, FirstName, LastName, Title, Email, Phone
-                        FROM MSPs
-                        LEFT JOIN VIPs VP on MSPs.ID = VP.MSPID
-                        WHERE 
-                            Name IS NOT NULL
-                            AND FirstName IS NOT NULL
-                            AND LastName IS NOT NULL
-                            AND Email IS NOT NULL
-                        ''')
-
-                    data = cursor.fetchall()
-
-                    with open(args.output_dir, 'w', newline='') as csv_file:
-                        csv_writer = csv.writer(csv_file)
-                        csv_writer.writerow(
-                            [i[0] for i in cursor.description])  # Write the column headers
-                        csv_writer.writerows(data)
-                # Export missing companies as csv
-                if args.output_missing:
-                    cursor.execute("WITH Numbers AS ("
-                                   "SELECT 1 AS num "
-                                   "UNION ALL "
-                                   "SELECT num + 1 "
-                                   "FROM Numbers "
-                                   "WHERE num < 500"
-                                   ") "
-                                   "SELECT num "
-                                   "FROM Numbers "
-                                   "LEFT JOIN VIPs ON Numbers.num = VIPs.MSPID "
-                                   "WHERE VIPs.MSPID IS NULL;")
-                    keys = [key[0] for key in cursor.fetchall()]
-                    cursor.execute(
-                        f"SELECT * FROM main.MSPs WHERE ID IN ({','.join(map(str, keys))});")
-                    missed_msps = cursor.fetchall()
-                    with open(args.output_dir, 'w', newline='') as csv_file:
-                        csv_writer = csv.writer(csv_file)
-                        csv_writer.writerow(
-                            [i[0] for i in cursor.description])  # Write the column headers
-                        csv_writer.writerows(missed_msps)
-            else:
-                print('Not outputting data')
+            spent = store_seamless_vips(cursor, self.scraper, self.normalizer,
+                                        [(payload['msp_id'],) + msp], drawn)
+        connection.commit()
+        jobs.return_credits(connection, jobs.SEAMLESS, drawn - spent)
+
+    @staticmethod
+    def cleanse(connection, payload):
+        """Loads a cleanse csv into the db"""
+        load_cleaned(connection, payload['csv_path'])
+
+
+def enqueue_jobs(connection, args):
+    """
+    Queues jobs for the worker
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param args: parsed enqueue subcommand arguments
+    """
+    if args.kind == jobs.CRN_REFRESH:
+        payloads = [{}]
+    elif args.kind == jobs.APOLLO:
+        payloads = [{'msp_id': msp_id} for (msp_id,) in connection.execute(
+            '''SELECT ID FROM MSPs''').fetchall()]
+    elif args.kind == jobs.SEAMLESS:
+        if args.credits is not None:
+            jobs.set_credits(connection, jobs.SEAMLESS, args.credits)
+            print(f'Seamless jobs may spend {args.credits} credits between them')
+        with closing(connection.cursor()) as cursor:
+            payloads = [{'msp_id': msp[0], 'credits': args.job_credits}
+                        for msp in get_missed_msps(cursor)]
+    else:
+        payloads = [{'csv_path': os.path.abspath(args.clean_csv)}]
+
+    queued = sum(jobs.enqueue(connection, args.kind, payload) for payload in payloads)
+    print(f'Queued {queued} {args.kind} jobs, {len(payloads) - queued} were already queued')
+
+
+def run_worker(connection, args):
+    """
+    Runs queued jobs until interrupted
+
+    :param connection: sqlite3 database connection to MSP.db
+    :param args: parsed worker subcommand arguments
+    """
+    with JobHandlers() as handlers:
+        jobs.work(connection, handlers, args.name, args.poll, args.lease, args.max_attempts,
+                  args.once)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the CLI, one subcommand per stage of the pipeline
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', help='path to the sqlite database', default='MSP.db')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    msps = subparsers.add_parser('msps', help='refreshes MSPs table, keeping existing ids')
+    msps.add_argument('-w', '--wipe', help='wipes MSPs table and loads new data',
+                      action='store_true')
+    msps.set_defaults(func=lambda connection, args: get_msps(connection, args.wipe))
+
+    vips = subparsers.add_parser('vips', help='refreshes VIPs table from Apollo')
+    vips.add_argument('-w', '--wipe', help='wipes VIPs table and loads new data',
+                      action='store_true')
+    vips.set_defaults(func=lambda connection, args: get_vips(connection, args.wipe))
+
+    seamless = subparsers.add_parser('seamless', help='scrapes seamless for missing MSPs')
+    seamless.add_argument('credits', help='number of seamless credits to spend', type=int)
+    seamless.add_argument('-b', '--batch_size', help='most MSPs searched per page load',
+                          type=int, default=10)
+    seamless.add_argument('--max_url_length', help='longest search url allowed', type=int,
+                          default=2000)
+    seamless.set_defaults(func=lambda connection, args: scrape_seamless(
+        connection, args.credits, args.batch_size, args.max_url_length))
+
+    cleanse = subparsers.add_parser('cleanse', help='loads cleaned csv from filepath into db')
+    cleanse.add_argument('clean_csv', help='full path to cleaned csv')
+    cleanse.set_defaults(func=lambda connection, args: load_cleaned(connection, args.clean_csv))
+
+    export = subparsers.add_parser('export', help='exports db as csv')
+    group = export.add_mutually_exclusive_group(required=True)
+    group.add_argument('-om', '--missing', help='outputs missing MSPs', action='store_true')
+    group.add_argument('-oa', '--all', help='outputs all data in a master csv',
+                       action='store_true')
+    export.add_argument('-o', '--output_dir', help='full path to file location, with filename',
+                        required=True)
+    export.set_defaults(
+        func=lambda connection, args: export_csv(connection, args.output_dir, args.missing))
+
+    normalize = subparsers.add_parser(
+        'normalize', help='backfills normalized emails, phones and domains')
+    normalize.add_argument('-j', '--workers', help='number of worker processes', type=int)
+    normalize.set_defaults(func=lambda connection, args: normalize_db(connection, args.workers))
+
+    enqueue = subparsers.add_parser('enqueue', help='queues jobs for the worker')
+    enqueue.add_argument('kind', help='kind of job to queue, one per MSP for apollo and seamless',
+                         choices=[jobs.CRN_REFRESH, jobs.APOLLO, jobs.SEAMLESS, jobs.CLEANSE])
+    enqueue.add_argument('--credits', help='seamless credits left for all jobs to share, kept '
+                                            'across runs', type=int)
+    enqueue.add_argument('--job_credits', help='most seamless credits one job may spend',
+                         type=int, default=50)
+    enqueue.add_argument('--clean_csv', help='full path to cleaned csv, for cleanse jobs',
+                         required=jobs.CLEANSE in sys.argv)
+    enqueue.set_defaults(func=enqueue_jobs)
+
+    worker = subparsers.add_parser('worker', help='runs queued jobs until interrupted')
+    worker.add_argument('--name', help='name of this worker, defaults to host:pid')
+    worker.add_argument('--poll', help='seconds to wait when the queue is empty', type=float,
+                        default=5)
+    worker.add_argument('--lease', help='seconds a job can go unrenewed before it is reclaimed',
+                        type=float, default=600)
+    worker.add_argument('--max_attempts', help='attempts before a job is marked failed',
+                        type=int, default=5)
+    worker.add_argument('--once', help='exit once the queue is empty', action='store_true')
+    worker.set_defaults(func=run_worker)
+
+    shard = subparsers.add_parser(
+        'shard', help='creates a shard db holding a hash partition of the MSPs')
+    shard.add_argument('index', help='which shard to create, from 0 to count - 1', type=int)
+    shard.add_argument('count', help='number of shards', type=int)
+    shard.add_argument('out', help='path of the shard db')
+    shard.set_defaults(func=lambda connection, args: print(
+        'Copied {} MSPs and {} VIPs to shard {} of {}'.format(
+            *shards.create_shard(connection, args.out, args.index, args.count), args.index,
+            args.count)))
+
+    merge = subparsers.add_parser('merge', help='merges shard dbs into the db')
+    merge.add_argument('shards', help='paths of the shard dbs', nargs='+')
+    merge.set_defaults(func=lambda connection, args: [print(
+        'Merged {} MSPs and {} VIPs from {}'.format(*shards.merge_shard(connection, path), path))
+        for path in args.shards])
+
+    dedupe = subparsers.add_parser(
+        'dedupe', help='merges duplicate VIPs and backfills identity keys')
+    dedupe.set_defaults(func=lambda connection, args: print(
+        f'Removed {dedupe_vips(connection)} duplicate VIPs'))
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # Get secrets, only the scraping subcommands need them
+    if args.command in ('vips', 'seamless', 'worker'):
+        from dotenv import load_dotenv
+        load_dotenv()
+
+    # Spin up db connection, and auto close on scope exit
+    with closing(sqlite3.connect(args.db)) as connection:
+
+        # Create or upgrade the schema if the db is behind
+        migrate(connection)
+
+        args.func(connection, args)
 
         # Persist changes to db
         connection.commit()
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-c', '--clean_csv', help='loads cleaned csv from filepath into db')
-    parser.add_argument('-w', '--wipe', help='wipes db and loads new data',
-                        action='store_true')
-    parser.add_argument('-rv', '--refresh_vips', help='refreshes VIPs table',
-                        action='store_true')
-    parser.add_argument('-rm', '--refresh_msps', help='refreshes MSPs table',
-                        action='store_true')
-    parser.add_argument('-su', '--seamless_update', help='scrapes seamless with n credits',
-                        type=int)
-    group = parser.add_mutually_exclusive_group()
-    group.add_argument('-om', '--output_missing', help='outputs missing MSPs',
-                       action='store_true')
-    group.add_argument('-oa', '--output_all', help='outputs all data in a master csv',
-                       action='store_true')
-    parser.add_argument('-o', '--output_dir', help='full path to file location, with filename',
-                        required=any(arg in sys.argv for arg in
-                                     ['--output_all', '-oa', '--output_missing', '-om']
-                                     ))
-    args = parser.parse_args()
     main()
@@ -0,0 +1,116 @@
+"""
+Schema Migrations
+===========
+
+Upgrades MSP.db in place, one numbered step at a time.
+
+The schema version is kept in sqlite's `user_version`, so startup only has to read one pragma
+when the db is already current. up.sql is step 1, every later change to the schema is appended
+to `migrations`, never edited once released.
+"""
+from contextlib import closing
+import os
+from contacts import dedupe_vips, ensure_identity_index
+
+
+def _base_schema(connection):
+    """Creates the tables in up.sql, leaves existing ones as they are"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'up.sql'),
+              'r') as sql_file:
+        connection.executescript(sql_file.read())
+
+
+def _covering_indexes(connection):
+    """Indexes the queries we actually run, so none of them scan VIPs"""
+    connection.executescript(
+        '''
+        -- Export join on MSPID, covering every column it reads. Also serves MAX(MSPID) and the
+        -- missing MSPs anti-join through its first column, so there is no separate MSPID index.
+        CREATE INDEX IF NOT EXISTS VIPs_MSPID
+            ON VIPs (MSPID, FirstName, LastName, Email, Title, Phone);
+
+        -- Cleanse updates look VIPs up by name
+        CREATE INDEX IF NOT EXISTS VIPs_Name ON VIPs (FirstName, LastName);
+
+        ANALYZE;
+        ''')
+
+
+def _msp_identity_keys(connection):
+    """
+    Rebuilds identity keys from the name and MSP domain, merging the contacts that were split
+    by the old email/phone keys. Cleanse now finds VIPs by identity key, not by name
+    """
+    dedupe_vips(connection)
+    connection.executescript(
+        '''
+        DROP INDEX IF EXISTS VIPs_Name;
+        ANALYZE;
+        ''')
+
+
+def _credits(connection):
+    """Keeps what's left of paid API budgets, such as Seamless credits, next to the rate limits"""
+    connection.executescript(
+        '''
+        CREATE TABLE IF NOT EXISTS Credits
+        (
+            Name TEXT primary key,
+            Remaining INTEGER NOT NULL
+        );
+        ''')
+
+
+# Step n upgrades a db from version n - 1 to n
+migrations = [
+    _base_schema,
+    ensure_identity_index,
+    _covering_indexes,
+    _msp_identity_keys,
+    _credits,
+]
+
+
+def schema_version(connection) -> int:
+    """Returns the schema version of a db, 0 if it predates migrations"""
+    return connection.execute('''PRAGMA user_version''').fetchone()[0]
+
+
+def migrate(connection) -> int:
+    """
+    Applies the migrations a db is behind on
+
+    :param connection: sqlite3 database connection to MSP.db
+    :return: schema version of the db
+    :rtype: int
+
+    Example::
+
+        >>> import sqlite3
+        >>> connection = sqlite3.connect(':memory:')
+        >>> _ = connection.executescript(
+        ...     'CREATE TABLE MSPs (ID INTEGER primary key AUTOINCREMENT, Name TEXT, URL TEXT, '
+        ...     'CompanyNumber TEXT); CREATE TABLE VIPs (ID INTEGER primary key AUTOINCREMENT, '
+        ...     'MSPID INTEGER, FirstName TEXT, LastName TEXT, Title TEXT, Email TEXT, Phone TEXT);'
+        ...     "INSERT INTO VIPs (MSPID, FirstName) VALUES (1, 'Bob')")
+        >>> migrate(connection)
+        Migrating db from version 0 to 5
+        5
+        >>> migrate(connection)
+        5
+        >>> connection.execute('SELECT MSPID, FirstName, IdentityKey FROM VIPs').fetchall()
+        [(1, 'Bob', 'bob |msp:1')]
+        >>> connection.execute('EXPLAIN QUERY PLAN SELECT MAX(MSPID) FROM VIPs').fetchall()[0][-1]
+        'SEARCH VIPs USING COVERING INDEX VIPs_MSPID'
+    """
+    version = schema_version(connection)
+    if version >= len(migrations):
+        return version
+
+    print(f'Migrating db from version {version} to {len(migrations)}')
+    for target, step in enumerate(migrations[version:], start=version + 1):
+        step(connection)
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(f'''PRAGMA user_version = {target}''')
+        connection.commit()
+    return len(migrations)
@@ -0,0 +1,188 @@
+"""
+Contact Normalization
+===========
+
+Validates and canonicalizes phones (E.164), emails and domains before they are stored.
+
+Every distinct value is only normalized once per `Normalizer`, and large batches are spread
+across a process pool, so backfills over the whole db scale with the number of cores.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+
+_email = re.compile(r'^[a-z0-9.!#$%&\'*+/=?^_`{|}~-]+@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+'
+                    r'[a-z]{2,}$')
+_domain = re.compile(r'^(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{2,}$')
+
+
+def normalize_phone(phone, region: str = 'US'):
+    """
+    Returns phone in E.164 format, or None if it isn't a valid number
+
+    :param phone: phone number in any format phonenumbers can parse
+    :type phone: str
+    :param region: region assumed for numbers without a country code
+    :type region: str
+    :rtype: str
+
+    Example::
+
+        >>> normalize_phone('(202) 456-1111')
+        '+12024561111'
+        >>> normalize_phone('+44 20 7946 0958')
+        '+442079460958'
+        >>> normalize_phone(2024561111.0)
+        '+12024561111'
+        >>> normalize_phone('555')
+    """
+    import phonenumbers
+
+    # pandas reads unformatted numbers as floats
+    if isinstance(phone, (int, float)) and phone == phone:
+        phone = str(int(phone))
+    if not phone or not isinstance(phone, str):
+        return None
+    try:
+        number = phonenumbers.parse(phone, region)
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(number):
+        return None
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def normalize_email(email):
+    """
+    Returns email lower-cased and stripped, or None if it isn't a valid address
+
+    Example::
+
+        >>> normalize_email(' Bob.Smith@ACME.com ')
+        'bob.smith@acme.com'
+        >>> normalize_email('mailto:bob@acme.com')
+        'bob@acme.com'
+        >>> normalize_email('bob@localhost')
+    """
+    if not email or not isinstance(email, str):
+        return None
+    email = email.strip().lower().removeprefix('mailto:')
+    return email if _email.match(email) else None
+
+
+def normalize_domain(domain):
+    """
+    Returns the bare domain.tld of a url or domain, or None if it isn't a valid domain
+
+    Example::
+
+        >>> normalize_domain('https://www.Acme.com/about')
+        'acme.com'
+        >>> normalize_domain('acme.co.uk')
+        'acme.co.uk'
+        >>> normalize_domain('not a domain')
+    """
+    if not domain or not isinstance(domain, str):
+        return None
+    domain = domain.strip().lower()
+    domain = re.sub(r'^[a-z]+://', '', domain).split('/', 1)[0].split(':', 1)[0]
+    domain = domain.removeprefix('www.').rstrip('.')
+    return domain if _domain.match(domain) else None
+
+
+normalizers = {
+    'phone': normalize_phone,
+    'email': normalize_email,
+    'domain': normalize_domain,
+}
+
+
+def _normalize_batch(kind: str, values: list) -> list:
+    """Normalizes a batch of values in a worker process"""
+    normalize = normalizers[kind]
+    return [normalize(value) for value in values]
+
+
+class Normalizer:
+    """
+    Memoized, batched normalization of phones, emails and domains.
+
+    Batches with fewer than `min_parallel` new values are normalized in process, larger ones
+    are split into chunks of `chunk_size` across a process pool that is started on first use.
+
+    :param workers: number of worker processes, defaults to the number of cores
+    :type workers: int
+    :param min_parallel: smallest number of new values worth sending to the pool
+    :type min_parallel: int
+    :param chunk_size: number of values sent to a worker at a time
+    :type chunk_size: int
+
+    Example::
+
+        >>> with Normalizer() as normalizer:
+        ...     normalizer.emails(['Bob@Acme.com', None, 'Bob@Acme.com'])
+        ['bob@acme.com', None, 'bob@acme.com']
+    """
+
+    def __init__(self, workers: int = None, min_parallel: int = 5000, chunk_size: int = 2000):
+        self.workers: int = workers or os.cpu_count() or 1
+        self.min_parallel: int = min_parallel
+        self.chunk_size: int = chunk_size
+        self.cache: dict = {kind: {} for kind in normalizers}
+        self.__pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
+    def normalize(self, kind: str, values) -> list:
+        """
+        Normalizes values, keeping their order
+
+        :param kind: one of 'phone', 'email' or 'domain'
+        :type kind: str
+        :param values: values to normalize
+        :type values: iterable
+        :return: normalized values, None where a value was invalid
+        :rtype: list
+
+        Example::
+
+            >>> normalizer = Normalizer(workers=2, min_parallel=2, chunk_size=1)
+            >>> normalizer.normalize('domain', ['www.acme.com', 'https://beta.io/', 'acme.com'])
+            ['acme.com', 'beta.io', 'acme.com']
+            >>> sorted(normalizer.cache['domain'])
+            ['acme.com', 'https://beta.io/', 'www.acme.com']
+            >>> normalizer.__exit__(None, None, None)
+        """
+        values = list(values)
+        cache = self.cache[kind]
+        new = list({value: None for value in values if value not in cache})
+
+        if len(new) < self.min_parallel or self.workers < 2:
+            cache.update(zip(new, _normalize_batch(kind, new)))
+        else:
+            if self.__pool is None:
+                self.__pool = ProcessPoolExecutor(self.workers)
+            chunks = [new[i:i + self.chunk_size] for i in range(0, len(new), self.chunk_size)]
+            for chunk, results in zip(chunks, self.__pool.map(
+                    _normalize_batch, [kind] * len(chunks), chunks)):
+                cache.update(zip(chunk, results))
+
+        return [cache[value] for value in values]
+
+    def phones(self, values) -> list:
+        """Normalizes phone numbers to E.164, see `normalize_phone`"""
+        return self.normalize('phone', values)
+
+    def emails(self, values) -> list:
+        """Normalizes emails, see `normalize_email`"""
+        return self.normalize('email', values)
+
+    def domains(self, values) -> list:
+        """Normalizes domains, see `normalize_domain`"""
+        return self.normalize('domain', values)
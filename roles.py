@@ -0,0 +1,227 @@
+"""
+Title Matching
+===========
+
+Normalizes and classifies job titles into the roles we are looking for.
+
+Apollo and Seamless both match titles loosely, so we search for a short list of broad titles
+and do the exact role filtering here, against one precompiled regex.
+"""
+import re
+
+# Roles to search for, in order of relevance, with every phrasing of them we accept.
+# Phrases are written in normalized form, see `normalize_title`.
+ROLES = {
+    'COO': ('chief operating officer', 'chief operations officer', 'coo'),
+    'CTO': ('chief technology officer', 'chief technical officer', 'cto'),
+    'CIO': ('chief innovation officer', 'chief information officer', 'cio'),
+    'VPO': ('vice president operations', 'vice president operation', 'vpo'),
+    # 'CEO': ('chief executive officer', 'ceo'),
+    # 'CPO': ('chief product officer', 'cpo'),
+}
+
+# Abbreviations and filler expanded or dropped before matching
+_expansions = {
+    'vp': 'vice president',
+    'v.p': 'vice president',
+    'svp': 'senior vice president',
+    'evp': 'executive vice president',
+    'avp': 'assistant vice president',
+    'ops': 'operations',
+    'info': 'information',
+    'tech': 'technology',
+    'vice-president': 'vice president',
+    'of': '',
+    'the': '',
+    'and': '',
+    '&': '',
+}
+
+# Titles that mention a role without holding it
+_excluded = re.compile(
+    r'\b(?:assistant|associate|deputy|sub|aide|secretary|staff|intern|trainee|advisor|former|'
+    r'office)\b')
+
+_separators = re.compile(r'[^a-z0-9&.\-]+')
+
+
+def normalize_title(title) -> str:
+    """
+    Lower-cases a title, strips punctuation and expands common abbreviations
+
+    :param title: job title as returned by Apollo or Seamless
+    :type title: str
+    :return: normalized title, words separated by single spaces
+    :rtype: str
+
+    Example::
+
+        >>> normalize_title(' COO')
+        'coo'
+        >>> normalize_title('VP of Ops & Strategy')
+        'vice president operations strategy'
+        >>> normalize_title('Co-Founder, CTO')
+        'co-founder cto'
+        >>> normalize_title(None)
+        ''
+    """
+    if not title:
+        return ''
+    words = []
+    for word in _separators.split(str(title).lower()):
+        word = _expansions.get(word.strip('.-'), word.strip('.-'))
+        if word:
+            words.append(word)
+    return ' '.join(words)
+
+
+def _trie_pattern(phrases) -> str:
+    """
+    Builds a regex from a word trie of phrases, so shared prefixes are only matched once
+
+    Example::
+
+        >>> _trie_pattern(['chief operating officer', 'chief operations officer', 'coo'])
+        '(?:chief (?:operating officer|operations officer)|coo)'
+        >>> _trie_pattern(['vice president', 'vice president operations'])
+        'vice president(?: operations)?'
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for word in phrase.split():
+            node = node.setdefault(word, {})
+        node[''] = {}
+
+    def build(node) -> str:
+        branches = []
+        for word, child in sorted(node.items()):
+            if word == '':
+                continue
+            rest = build(child)
+            if not rest:
+                branches.append(re.escape(word))
+            elif '' in child:
+                # A phrase ends here, and a longer one continues
+                branches.append(f'{re.escape(word)}(?: {rest})?')
+            else:
+                branches.append(f'{re.escape(word)} {rest}')
+        if len(branches) == 1:
+            return branches[0]
+        return f'(?:{"|".join(branches)})' if branches else ''
+
+    return build(trie)
+
+
+class TitleMatcher:
+    """
+    Classifies job titles into roles and ranks people by how relevant their title is.
+
+    :param roles: dictionary of {role: normalized phrases}, in order of relevance
+    :type roles: dict
+
+    :ivar roles: list of role names, in order of relevance
+    :type roles: list
+    """
+
+    def __init__(self, roles: dict = None):
+        """
+        Precompiles a single regex matching every phrase of every role
+
+        :param roles: dictionary of {role: normalized phrases}, in order of relevance
+        :type roles: dict
+        """
+        if roles is None:
+            roles = ROLES
+        self.roles: list = list(roles)
+        self.__phrases = {role: tuple(normalize_title(phrase) for phrase in phrases)
+                          for role, phrases in roles.items()}
+        self.__pattern = re.compile('|'.join(
+            f'(?P<{role}>(?<![a-z0-9]){_trie_pattern(phrases)}(?![a-z0-9]))'
+            for role, phrases in self.__phrases.items()))
+
+    @property
+    def query_titles(self) -> list:
+        """
+        Short list of titles to send to Apollo and Seamless, the longest phrase and the
+        abbreviation of each role
+
+        Example::
+
+            >>> TitleMatcher().query_titles # doctest: +ELLIPSIS
+            ['Chief Operating Officer', 'COO', 'Chief Technology Officer', 'CTO', ...]
+        """
+        titles = []
+        for role, phrases in self.__phrases.items():
+            titles.append(phrases[0].title())
+            titles.append(role)
+        return titles
+
+    def classify(self, title):
+        """
+        Returns the most relevant role held under title, or None
+
+        Example::
+
+            >>> matcher = TitleMatcher()
+            >>> matcher.classify('Co-Founder & Chief Technology Officer')
+            'CTO'
+            >>> matcher.classify('VP, Operations')
+            'VPO'
+            >>> matcher.classify('CTO / COO')
+            'COO'
+            >>> matcher.classify('Executive Assistant to the COO')
+            >>> matcher.classify('Deputy COO')
+            >>> matcher.classify('Chief of Staff to the CTO')
+            >>> matcher.classify('Director of Cooking')
+        """
+        match = self.score(title)
+        return match[1] if match is not None else None
+
+    def score(self, title):
+        """
+        Returns a sortable (relevance, role) pair for title, or None if it holds no role
+
+        Relevance prefers more important roles, then titles that are nothing but the role.
+
+        Example::
+
+            >>> matcher = TitleMatcher()
+            >>> matcher.score('Chief Operating Officer') > matcher.score('COO & Co-Founder')
+            True
+            >>> matcher.score('CTO') > matcher.score('Chief Operating Officer')
+            False
+        """
+        normalized = normalize_title(title)
+        if not normalized or _excluded.search(normalized):
+            return None
+        best = None
+        for match in self.__pattern.finditer(normalized):
+            role = match.lastgroup
+            exact = match.end() - match.start() == len(normalized)
+            relevance = (-self.roles.index(role), exact)
+            if best is None or relevance > best[0]:
+                best = (relevance, role)
+        return best
+
+    def rank(self, items, title_of=lambda item: item):
+        """
+        Keeps items whose title holds a role, most relevant first
+
+        :param items: people, in any shape
+        :type items: list
+        :param title_of: function returning the title of an item
+        :return: items with a matching title, sorted by relevance
+        :rtype: list
+
+        Example::
+
+            >>> TitleMatcher().rank(['Sales Lead', 'CTO', 'VP Operations', 'Chief Operating Officer'])
+            ['Chief Operating Officer', 'CTO', 'VP Operations']
+            >>> TitleMatcher().rank([{'title': 'cto'}, {'title': None}], lambda p: p['title'])
+            [{'title': 'cto'}]
+        """
+        scored = [(score, index, item) for index, item in enumerate(items)
+                  if (score := self.score(title_of(item))) is not None]
+        scored.sort(key=lambda entry: (entry[0][0], -entry[1]), reverse=True)
+        return [item for _, _, item in scored]
@@ -2,13 +2,13 @@ from time import sleep
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
-import pandas
-import phonenumbers
 
 
 class Seamless:
     companies_exact_match = 'true'
-    titles_exact_match = 'true'
+    # Searches send a few broad titles and rows are filtered by role locally, so matching them
+    # loosely is what keeps phrasings like 'VP of Operations' in the results
+    titles_exact_match = 'false'
 
     buttons_path = (
         "/html/body/div[1]/div/div/div[2]/div[1]/div[2]/div[2]/table/tbody/tr/td[6]/div"
@@ -16,6 +16,7 @@ class Seamless:
     data_super_path = "//div[@id='PageContainer']/div[2]/div[2]/table/tbody/tr"
     name_path = "./td[2]/div/div[2]/div[1]/div[1]"
     title_path = "./td[2]/div/div[2]/div[1]/div[2]"
+    company_path = "./td[3]/div/div[1]"
     email_group_path = "./td[4]/div/div[1][not(contains(@class, 'Locked'))]"
     # "/html/body/div[1]/div/div/div[2]/div[1]/div[2]/div[2]/table/tbody/tr/td[4]/div/div[2]/div[2]/div/button"
     email_subpath = "./div/div/button"
@@ -41,10 +42,71 @@ class Seamless:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.driver.quit()
 
+    @classmethod
+    def search_url(cls, companies: list, titles: list) -> str:
+        """
+        Builds the url of the first page of a contacts search
+
+        :param companies: Companies list, by name and/or domain
+        :type companies: list
+        :param titles: Titles list of str
+        :type titles: list
+        :rtype: str
+        """
+        return (f'https://login.seamless.ai/search/contacts?'
+                f'page=1&'
+                f'companies={"|".join(companies)}&'
+                f'companiesExactMatch={cls.companies_exact_match}&'
+                f'locations=1&'
+                f'locationTypes=both&'
+                f'seniorities=1&'
+                f'titles={"|".join(titles)}&'
+                f'titlesExactMatch={cls.titles_exact_match}')
+
+    @classmethod
+    def batch_companies(cls, companies: list, titles: list, max_companies: int = 10,
+                        max_url_length: int = 2000) -> list:
+        """
+        Groups companies into as few searches as possible, each within max_companies and
+        max_url_length
+
+        :param companies: Companies list, by name and/or domain
+        :type companies: list
+        :param titles: Titles list of str
+        :type titles: list
+        :param max_companies: most companies searched at once, bounds the number of results
+        :type max_companies: int
+        :param max_url_length: longest search url allowed
+        :type max_url_length: int
+        :return: list of company lists, one per search
+        :rtype: list
+
+        Example::
+
+            >>> Seamless.batch_companies(['a.com', 'b.com', 'c.com'], ['CTO'], 2)
+            [['a.com', 'b.com'], ['c.com']]
+            >>> Seamless.batch_companies(['a.com', 'b.com', 'c.com'], ['CTO'],
+            ...                          max_url_length=len(Seamless.search_url(
+            ...                              ['a.com', 'b.com'], ['CTO'])))
+            [['a.com', 'b.com'], ['c.com']]
+        """
+        batches = []
+        for company in companies:
+            if (batches and len(batches[-1]) < max_companies and
+                    len(cls.search_url(batches[-1] + [company], titles)) <= max_url_length):
+                batches[-1].append(company)
+            else:
+                batches.append([company])
+        return batches
+
     def seamless_scrape_vips(self, companies: list, titles: list, credit_budget: int):
         """
         Scrapes Seamless.ai for VIPs information
 
+        Results are (first name, last name, title, email, company) tuples, company being the
+        name Seamless lists the contact under, so searches of several companies can be mapped
+        back to each of them.
+
         :param companies: Companies list, by name and/or domain
         :type companies: list
         :param titles: Titles list of str
@@ -67,16 +129,7 @@ class Seamless:
         """
 
         try:
-            self.__get_with_redirection_check(
-                f'https://login.seamless.ai/search/contacts?'
-                f'page=1&'
-                f'companies={"|".join(companies)}&'
-                f'companiesExactMatch={self.companies_exact_match}&'
-                f'locations=1&'
-                f'locationTypes=both&'
-                f'seniorities=1&'
-                f'titles={"|".join(titles)}&'
-                f'titlesExactMatch={self.titles_exact_match}')
+            self.__get_with_redirection_check(self.search_url(companies, titles))
         except RedirectedError:
 
             # If we got redirected to log in, it's harmless to keep going
@@ -92,15 +145,15 @@ class Seamless:
             number_of_pages = 0
 
         results = []
+        credits_spent = 0
         while True:
             buttons = self.driver.find_elements(By.XPATH, self.buttons_path)
             print(f'Spending {len(buttons)} credits')
-            credits_spent = 0
 
-            for index, button in enumerate(buttons, start=1):
+            for button in buttons:
 
-                # Check if we can spend credits
-                if index > credit_budget:
+                # Check if we can spend credits, the budget covers every page
+                if credits_spent >= credit_budget:
                     break
 
                 print(f'clicking button {button}')
@@ -115,6 +168,8 @@ class Seamless:
                     By.XPATH, self.email_subpath)] for group in email_groups]
                 name = vip.find_elements(By.XPATH, self.name_path)[0].text
                 title = vip.find_elements(By.XPATH, self.title_path)[0].text
+                company = vip.find_elements(By.XPATH, self.company_path)
+                company = company[0].text if company else None
 
                 if not emails:
 
@@ -127,7 +182,8 @@ class Seamless:
                 else:
                     print(f'the fucking emails were ')
                     print(emails)
-                    results.append(tuple(name.split(" ")) + (title, emails[0][0]))
+                    first_name, _, last_name = name.partition(' ')
+                    results.append((first_name, last_name, title, emails[0][0], company))
 
             # Do for all pages until there are none
             if not self.__next_page(number_of_pages):
@@ -188,95 +244,6 @@ class Seamless:
                 f'Current url:\n\t{self.driver.current_url}\nDifferent from requested url:\n\t{url}'
             )
 
-    @staticmethod
-    def extract_cleaned(csv_path: str, required_conf: int) -> dict:
-        """
-        Get a parsed dictionary of cleaned data given a csv from https://login.seamless.ai/enrich
-
-        :param csv_path: full path, including file, of csv to extract from
-        :type csv_path: str
-        :param required_conf: % chance reqired to treat data as true (required_conf/100)
-        :type required_conf: int
-        :return: dictionary of emails and phone numbers keyed by tuple (first, last) name
-        :rtype: dict
-
-        Example::
-            >>> import pandas; import phonenumbers
-            >>> Seamless.extract_cleaned("/Users/adam/Downloads/cleanse_test-raw.csv", 70)
-            ... # doctest: +ELLIPSIS
-            {('Chuck', 'Bloodworth'): {'email': 'cbloodworth@1path.com'},...}
-        """
-
-        # load file and extracted needed columns
-        first_ten = pandas.read_csv(csv_path)[
-            ['First Name', 'Last Name'] +
-            [f'Email {i} Total AI' for i in range(1, 11)] +
-            [f'Email {i}' for i in range(1, 11)] +
-            [f'Contact Phone {i} Total AI' for i in range(1, 11)] +
-            [f'Contact Phone {i}' for i in range(1, 11)]
-            ]
-
-        # start results dictionary
-        result_list = {}
-
-        # iterate through the 10 columns each of phone and email
-        for index in range(1, 11):
-
-            # 'total ai format' is ##%, change to integer to preform '>' operation against required_conf
-            temp_row = first_ten[first_ten[f'Email {index}'].notna()]
-            if not temp_row.empty:
-                first_ten[f'Email {index} Total AI'] = temp_row[
-                    f'Email {index} Total AI'].str.replace('%', '').astype(int)
-
-            temp_row = first_ten[first_ten[f'Contact Phone {index}'].notna()]
-            if not temp_row.empty:
-                first_ten[f'Contact Phone {index} Total AI'] = temp_row[
-                    f'Contact Phone {index} Total AI'].str.replace('%', '').astype(int)
-
-            # check if email and number meet criteria, and add them to our results
-            emails = first_ten[first_ten[f'Email {index} Total AI'] > required_conf].apply(
-                lambda row, idx:
-                {(row['First Name'], row['Last Name']): (row[f'Email {idx}'])},
-                args=(index,),
-                axis=1).tolist()
-            phones = first_ten[first_ten[f'Contact Phone {index} Total AI'] > required_conf].apply(
-                lambda row, idx:
-                {(row['First Name'], row['Last Name']): (row[f'Contact Phone {idx}'])},
-                args=(index,),
-                axis=1).tolist()
-
-            for email_dict in emails:
-                for key, value in email_dict.items():
-                    if key not in result_list:
-                        # print(f'eKey {key} does not exist in results')
-                        result_list[key] = {}
-                        result_list[key]['email'] = value
-                    elif not result_list.get(key, {}).get('email', False):
-                        # print(f'eKey {key} does exist in results without email')
-                        result_list[key]['email'] = value
-                    else:
-                        pass
-                        # print(f'eKey {key} does exist in results with email')
-
-            for phone_dict in phones:
-                for key, value in phone_dict.items():
-                    if key not in result_list:
-                        # print(f'pKey {key} does not exist in results')
-                        result_list[key] = {}
-                        result_list[key]['phone'] = phonenumbers.format_number(
-                            phonenumbers.parse(value, 'US'),
-                            phonenumbers.PhoneNumberFormat.E164)
-                    elif not result_list.get(key, {}).get('phone', False):
-                        # print(f'pKey {key} does exist in results without phone')
-                        result_list[key]['phone'] = phonenumbers.format_number(
-                            phonenumbers.parse(value, 'US'),
-                            phonenumbers.PhoneNumberFormat.E164)
-                    else:
-                        pass
-                        # print(f'pKey {key} does exist in results with phone')
-
-        return result_list
-
 
 class RedirectedError(Exception):
     def __init__(self, message):
@@ -0,0 +1,214 @@
+"""
+Sharded Runs
+===========
+
+Splits the MSPs across nodes so enrichment can run on several machines at once, and merges
+what they collected back into the main db.
+
+Each node gets a deterministic hash partition of the MSPs by domain, copied with their ids and
+the VIPs already found for them into its own shard db, and runs the usual subcommands against
+it. Merging keeps MSP ids and folds VIPs in by identity key, so merging a shard twice changes
+nothing. A shard whose MSP ids now belong to other companies in the main db is refused.
+
+Example, three shard processes enriching in parallel then merged twice::
+
+    >>> import os, sqlite3, subprocess, sys, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> main_db = sqlite3.connect(os.path.join(tmp, 'MSP.db'))
+    >>> migrate(main_db)
+    Migrating db from version 0 to 5
+    5
+    >>> _ = main_db.executemany('INSERT INTO MSPs (Name, URL) VALUES (?, ?)',
+    ...                         [(f'MSP {i}', f'msp{i}.com') for i in range(1, 31)])
+    >>> upsert_vips(main_db, [(1, 'Ann', 'Lee', 'COO', 'ann@msp1.com', None)])
+    >>> paths = [os.path.join(tmp, f'shard_{i}.db') for i in range(3)]
+    >>> [sum(counts) for counts in zip(*(create_shard(main_db, path, i, 3)
+    ...                                  for i, path in enumerate(paths)))]
+    Migrating db from version 0 to 5
+    Migrating db from version 0 to 5
+    Migrating db from version 0 to 5
+    [30, 1]
+    >>> workers = [subprocess.Popen([sys.executable, '-c', (
+    ...     'import sqlite3, sys; from contacts import upsert_vips; '
+    ...     'db = sqlite3.connect(sys.argv[1]); '
+    ...     'upsert_vips(db, [(i, "Bob", f"Smith{i}", "CTO", f"bob@{url}", None) '
+    ...     '    for i, url in db.execute("SELECT ID, URL FROM MSPs").fetchall()]); '
+    ...     'db.commit()'), path]) for path in paths]
+    >>> [worker.wait() for worker in workers]
+    [0, 0, 0]
+    >>> [merge_shard(main_db, path) for path in paths] == [merge_shard(main_db, path)
+    ...                                                    for path in paths]
+    True
+    >>> main_db.execute('SELECT COUNT(*), COUNT(DISTINCT MSPID) FROM VIPs').fetchone()
+    (31, 30)
+    >>> main_db.execute("SELECT MSPID FROM VIPs WHERE Email = 'bob@msp7.com'").fetchone()
+    (7,)
+
+Once the main db has been rescraped and an id points at another company, merging is refused::
+
+    >>> _ = main_db.execute("UPDATE MSPs SET URL = 'other.com' WHERE ID = 7")
+    >>> [merge_shard(main_db, path) for path in paths] # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: ... MSP 7 is msp7.com in the shard but other.com in the main db...
+
+Even when neither URL is a valid domain::
+
+    >>> _ = main_db.execute("UPDATE MSPs SET URL = 'msp7' WHERE ID = 7")
+    >>> with closing(sqlite3.connect(paths[shard_of('msp7.com', 3)])) as shard:
+    ...     _ = shard.execute("UPDATE MSPs SET URL = 'another' WHERE ID = 7")
+    ...     shard.commit()
+    >>> [merge_shard(main_db, path) for path in paths] # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: ... MSP 7 is another in the shard but msp7 in the main db...
+"""
+from contextlib import closing
+import hashlib
+import sqlite3
+from contacts import upsert_vips
+from migrations import migrate
+from normalize import normalize_domain
+
+
+def shard_of(domain, count: int, msp_id: int = None) -> int:
+    """
+    Returns which of count shards an MSP belongs to, the same on every machine and run
+
+    MSPs are partitioned by domain so the same company lands on the same shard across lists
+    and years, falling back to its id when it has no valid domain.
+
+    Example::
+
+        >>> shard_of('https://www.acme.com', 4) == shard_of('acme.com', 4)
+        True
+        >>> sorted({shard_of(f'msp{i}.com', 4) for i in range(100)})
+        [0, 1, 2, 3]
+    """
+    key = normalize_domain(domain) or f'id:{msp_id}'
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big') % count
+
+
+def _open(path: str):
+    """Connects to a db, creating or upgrading its schema if it's behind"""
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    return connection
+
+
+def create_shard(connection, path: str, index: int, count: int, batch_size: int = 10000) -> tuple:
+    """
+    Copies the MSPs of one shard, with their ids and the VIPs already found for them, into a
+    shard db
+
+    The VIPs let the shard skip MSPs that are already done, instead of spending Apollo requests
+    and Seamless credits on them again.
+
+    :param connection: sqlite3 database connection to the main MSP.db
+    :param path: path of the shard db, created if it doesn't exist
+    :type path: str
+    :param index: which shard to create, from 0 to count - 1
+    :type index: int
+    :param count: number of shards
+    :type count: int
+    :param batch_size: number of VIPs read from the main db at a time
+    :type batch_size: int
+    :return: number of MSPs and VIPs in the shard
+    :rtype: tuple
+
+    Example, a shard's vips run only queries Apollo for its MSPs that have no VIPs yet::
+
+        >>> import contextlib, io, os, tempfile; from apollo import Person; import main
+        >>> class StubApollo:
+        ...     def __init__(self):
+        ...         self.urls = []
+        ...     def get_people_filtered(self, url, titles):
+        ...         self.urls.append(url)
+        ...         return [Person('1', 'Cal', 'Ng', 'CTO', None, None, None)]
+        >>> main_db = sqlite3.connect(':memory:')
+        >>> migrate(main_db) # doctest: +ELLIPSIS
+        Migrating db ...
+        >>> _ = main_db.executemany('INSERT INTO MSPs (Name, URL) VALUES (?, ?)',
+        ...                         [(f'MSP {i}', f'msp{i}.com') for i in range(1, 31)])
+        >>> upsert_vips(main_db, [(30, 'Ann', 'Lee', 'COO', 'ann@msp30.com', None)])
+        >>> path = os.path.join(tempfile.mkdtemp(), 'shard.db')
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     msps, vips = create_shard(main_db, path, shard_of('msp30.com', 2), 2)
+        >>> api = StubApollo()
+        >>> with closing(sqlite3.connect(path)) as shard, contextlib.redirect_stdout(io.StringIO()):
+        ...     main.get_vips(shard, api=api)
+        >>> vips, len(api.urls) == msps - 1, 'msp30.com' in api.urls
+        (1, True, False)
+    """
+    if not 0 <= index < count:
+        raise ValueError(f'Shard index {index} is not in [0, {count})')
+
+    msps = [msp for msp in connection.execute(
+        '''SELECT ID, Name, URL, CompanyNumber FROM MSPs''').fetchall()
+            if shard_of(msp[2], count, msp[0]) == index]
+    msp_ids = {msp[0] for msp in msps}
+    with closing(_open(path)) as shard:
+        shard.executemany(
+            '''INSERT OR REPLACE INTO MSPs (ID, Name, URL, CompanyNumber) VALUES (?, ?, ?, ?)''',
+            msps)
+
+        vips = 0
+        reader = connection.execute(
+            '''SELECT ID, MSPID, FirstName, LastName, Title, Email, Phone, IdentityKey '''
+            '''FROM VIPs ORDER BY ID''')
+        while rows := reader.fetchmany(batch_size):
+            rows = [row for row in rows if row[1] in msp_ids]
+            shard.executemany(
+                '''INSERT OR REPLACE INTO VIPs '''
+                '''(ID, MSPID, FirstName, LastName, Title, Email, Phone, IdentityKey) '''
+                '''VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            vips += len(rows)
+        shard.commit()
+    return len(msps), vips
+
+
+def merge_shard(connection, path: str, batch_size: int = 10000) -> tuple:
+    """
+    Merges a shard db into the main db, idempotently
+
+    MSPs keep their ids, filling in any company number the main db is missing. VIPs are
+    upserted by identity key, so ones already merged or collected elsewhere aren't duplicated.
+    Nothing is merged if any of the shard's MSP ids now has a different domain in the main db,
+    as when it was wiped and rescraped after the shard was made, since its VIPs would land on
+    the wrong company.
+
+    :param connection: sqlite3 database connection to the main MSP.db
+    :param path: path of the shard db
+    :type path: str
+    :param batch_size: number of VIPs read from the shard at a time
+    :type batch_size: int
+    :return: number of MSPs and VIPs in the shard
+    :rtype: tuple
+    :raises ValueError: if the shard's MSPs don't match the main db's
+    """
+    with closing(_open(path)) as shard:
+        msps = shard.execute('''SELECT ID, Name, URL, CompanyNumber FROM MSPs''').fetchall()
+        urls = dict(connection.execute('''SELECT ID, URL FROM MSPs''').fetchall())
+        # URLs that aren't valid domains are compared as they are, rather than all as None
+        mismatched = [f'MSP {msp_id} is {url} in the shard but {urls[msp_id]} in the main db'
+                      for msp_id, _, url, _ in msps
+                      if msp_id in urls and (normalize_domain(urls[msp_id]) or urls[msp_id])
+                      != (normalize_domain(url) or url)]
+        if mismatched:
+            raise ValueError(f'Refusing to merge {path}, its MSPs no longer match: '
+                             + '; '.join(mismatched))
+
+        with closing(connection.cursor()) as cursor:
+            cursor.executemany(
+                '''INSERT INTO MSPs (ID, Name, URL, CompanyNumber) VALUES (?, ?, ?, ?) '''
+                '''ON CONFLICT(ID) DO UPDATE SET '''
+                '''CompanyNumber = COALESCE(MSPs.CompanyNumber, excluded.CompanyNumber)''', msps)
+
+            vips = 0
+            reader = shard.execute(
+                '''SELECT MSPID, FirstName, LastName, Title, Email, Phone FROM VIPs ORDER BY ID''')
+            while rows := reader.fetchmany(batch_size):
+                upsert_vips(cursor, rows)
+                vips += len(rows)
+        connection.commit()
+    return len(msps), vips
@@ -15,5 +15,33 @@ CREATE TABLE IF NOT EXISTS VIPs
     Title TEXT,
     Email TEXT,
     Phone TEXT,
+    IdentityKey TEXT,
     FOREIGN KEY (MSPID) REFERENCES MSPs(ID)
+);
+
+CREATE TABLE IF NOT EXISTS Jobs
+(
+    ID   INTEGER primary key AUTOINCREMENT,
+    Kind TEXT NOT NULL,
+    Payload TEXT NOT NULL,
+    Status TEXT NOT NULL DEFAULT 'pending',
+    Attempts INTEGER NOT NULL DEFAULT 0,
+    RunAfter REAL NOT NULL,
+    Worker TEXT,
+    LeaseExpires REAL,
+    LastError TEXT
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS Jobs_Active ON Jobs (Kind, Payload)
+    WHERE Status IN ('pending', 'running');
+
+CREATE INDEX IF NOT EXISTS Jobs_Runnable ON Jobs (Status, RunAfter);
+
+CREATE TABLE IF NOT EXISTS RateLimits
+(
+    Name TEXT primary key,
+    Minute INTEGER,
+    Hour INTEGER,
+    Day INTEGER,
+    Observed REAL
 )